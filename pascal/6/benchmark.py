@@ -0,0 +1,84 @@
+"""
+tree walking Interpreter vs SlotInterpreter vs Compiler + VirtualMachine on long programs of random assignments
+
+python benchmark.py --statements 20000 --variables 50 --repeats 5
+"""
+import time
+import random
+import argparse
+from interpretty import Tokenizer, Parser, Interpreter, SemanticAnalyzer, SlotInterpreter, Compiler, VirtualMachine
+
+
+def expression(rng, variables, depth):
+    """
+    a random expression over the first `variables` names,
+    the right side of * and / is a constant so it doesn't divide by 0 and is at most 18 ** depth times its variables
+    """
+    if depth == 0:
+        return f'v{rng.randrange(variables)}' if rng.random() < 0.6 else str(rng.randint(1, 99))
+    op = rng.choice('+-*/')
+    left = expression(rng, variables, depth - 1)
+    right = str(rng.randint(2, 9)) if op in '*/' else expression(rng, variables, depth - 1)
+    return f'({left} {op} {right})'
+
+
+def assignment_program(statements, variables, depth, seed=0):
+    """every variable is assigned once before the random statements, which nest a BEGIN ... END every 100"""
+    rng = random.Random(seed)
+    lines = [f'v{i} := {rng.randint(1, 99)}' for i in range(variables)]
+    for i in range(statements):
+        # dividing by more than the expression can grow keeps the values from turning into big integers
+        divisor = 18 ** depth * rng.randint(1, 9)
+        lines.append(f'v{rng.randrange(variables)} := {expression(rng, variables, depth)} / {divisor}')
+        if i % 100 == 99:
+            lines.append('BEGIN x := 1; y := x END')
+    return 'BEGIN\n' + ';\n'.join(lines) + '\nEND.'
+
+
+def best_of(repeats, function, *args):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--statements', type=int, default=20_000)
+    parser.add_argument('--variables', type=int, default=50)
+    parser.add_argument('--depth', type=int, default=3, help='of the expression trees')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    text = assignment_program(args.statements, args.variables, args.depth)
+    start = time.perf_counter()
+    tree = Parser(Tokenizer(text)).parse()
+    print(f'{args.statements} statements, {len(text) / 1024:.0f} KiB, parsed in {time.perf_counter() - start:.2f}s')
+
+    interpreter = Interpreter(None)
+    walk_seconds = best_of(args.repeats, interpreter.visit, tree)
+    analyze_seconds = best_of(args.repeats, lambda: SemanticAnalyzer().analyze(tree))
+    symbols = SemanticAnalyzer().analyze(tree)
+    slot_interpreter = SlotInterpreter(None)
+    slot_seconds = best_of(args.repeats, slot_interpreter.run, tree, symbols)
+    assert list(slot_interpreter.GLOBAL_SCOPE.items()) == list(interpreter.GLOBAL_SCOPE.items())
+    compile_seconds = best_of(args.repeats, lambda: Compiler().compile(tree))
+    bytecode = Compiler().compile(tree)
+    vm = VirtualMachine(None)
+    run_seconds = best_of(args.repeats, vm.run, bytecode)
+    assert list(vm.GLOBAL_SCOPE.items()) == list(interpreter.GLOBAL_SCOPE.items())
+
+    print(f'{len(bytecode.code) // 2} instructions, {len(bytecode.constants)} constants, {len(bytecode.names)} slots')
+    print(f'tree walk  {walk_seconds * 1000:8.1f} ms')
+    print(f'analyze    {analyze_seconds * 1000:8.1f} ms')
+    print(f'slots      {slot_seconds * 1000:8.1f} ms, {walk_seconds / slot_seconds:.1f}x the tree walk, '
+          f'{walk_seconds / (analyze_seconds + slot_seconds):.1f}x with analyzing, same GLOBAL_SCOPE')
+    print(f'compile    {compile_seconds * 1000:8.1f} ms')
+    print(f'vm run     {run_seconds * 1000:8.1f} ms, {walk_seconds / run_seconds:.1f}x the tree walk, '
+          f'{walk_seconds / (compile_seconds + run_seconds):.1f}x with compiling, same GLOBAL_SCOPE')
+
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,10 @@ class NodeVisitorError(Exception):
     pass
 
 
+class SemanticError(Exception):
+    pass
+
+
 RESERVED_KEYWORDS = {
     'BEGIN': Token('BEGIN', 'BEGIN'),
     'END': Token('END', 'END'),
@@ -181,6 +185,8 @@ class Variable(ASTNode):
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        # index into the slots of the program, set by SemanticAnalyzer
+        self.slot = None
 
 
 class NoOp(ASTNode):
@@ -339,6 +345,16 @@ class NodeVisitor:
         raise NodeVisitorError(f'No method to visit {type(node).__name__}')
 
 
+class CachedNodeVisitor(NodeVisitor):
+    """NodeVisitor that looks up the visit method once per node class instead of once per node"""
+
+    def visit(self, node):
+        visitor = self.visitors.get(type(node))
+        if visitor is None:
+            visitor = self.visitors[type(node)] = getattr(self, 'visit_' + type(node).__name__, self.generic_visit)
+        return visitor(node)
+
+
 class Interpreter(NodeVisitor):
     def __init__(self, parser):
         self.parser = parser
@@ -381,6 +397,232 @@ class Interpreter(NodeVisitor):
         return self.visit(tree)
 
 
+# a slot no assignment has run for yet
+UNSET = object()
+
+
+class SymbolTable:
+    """Names of the variables of a program and their slots, numbered in the order they are defined"""
+
+    def __init__(self):
+        self.slots = {}
+        self.names = []
+
+    def define(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def lookup(self, name):
+        return self.slots.get(name)
+
+
+class SemanticAnalyzer(CachedNodeVisitor):
+    """
+    Resolves every Variable of the AST to a slot before anything runs
+
+    a variable is declared by its first assignment, statements run in order,
+    so a name read before it is assigned is an error of the program, whatever the values,
+    all of them are reported at once instead of the first one the interpreter runs into
+    """
+
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.unassigned = []
+        self.visitors = {}
+
+    def analyze(self, tree):
+        self.visit(tree)
+        if self.unassigned:
+            names = ', '.join(repr(name) for name in dict.fromkeys(self.unassigned))
+            raise SemanticError(f"SemanticError: used before assignment {names}")
+        return self.symbols
+
+    def visit_BinaryOperator(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Num(self, node):
+        pass
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_Assignment(self, node):
+        # the right side runs first, a := a + 1 reads a before it is assigned
+        self.visit(node.right)
+        node.left.slot = self.symbols.define(node.left.value)
+
+    def visit_Variable(self, node):
+        node.slot = self.symbols.lookup(node.value)
+        if node.slot is None:
+            self.unassigned.append(node.value)
+
+    def visit_NoOp(self, node):
+        pass
+
+
+class SlotInterpreter(CachedNodeVisitor, Interpreter):
+    """
+    Interpreter that keeps variables in a flat list of slots instead of the GLOBAL_SCOPE dict
+
+    SemanticAnalyzer runs first, so every Variable has its slot and every read finds a value,
+    GLOBAL_SCOPE gets the assigned slots when the program stops
+    """
+
+    def __init__(self, parser):
+        super().__init__(parser)
+        self.slots = []
+        self.visitors = {}
+
+    def visit_Assignment(self, node):
+        self.slots[node.left.slot] = self.visit(node.right)
+
+    def visit_Variable(self, node):
+        return self.slots[node.slot]
+
+    def run(self, tree, symbols):
+        self.slots = [UNSET] * len(symbols.names)
+        try:
+            return self.visit(tree)
+        finally:
+            self.GLOBAL_SCOPE = {name: value for name, value in zip(symbols.names, self.slots) if value is not UNSET}
+
+    def eval(self):
+        tree = self.parser.parse()
+        return self.run(tree, SemanticAnalyzer().analyze(tree))
+
+
+# opcodes of the bytecode, binary operators take their operands from the stack and push the result
+OP_LOAD_CONST, OP_LOAD_VAR, OP_STORE_VAR, OP_ADD, OP_SUB, OP_MUL, OP_DIV = range(7)
+
+BINARY_OPCODES = {PLUS: OP_ADD, MINUS: OP_SUB, MUL: OP_MUL, DIV: OP_DIV}
+
+OPCODE_NAMES = ['LOAD_CONST', 'LOAD_VAR', 'STORE_VAR', 'ADD', 'SUB', 'MUL', 'DIV']
+
+
+class Bytecode:
+    """
+    code is a flat list of opcode, operand pairs, binary operators have a 0 operand,
+    LOAD_CONST operands are indexes into constants, LOAD_VAR and STORE_VAR operands are slots, indexes into names
+    """
+
+    def __init__(self, code, constants, names):
+        self.code = code
+        self.constants = constants
+        self.names = names
+
+    def __str__(self):
+        lines = []
+        for pos in range(0, len(self.code), 2):
+            opcode, operand = self.code[pos], self.code[pos + 1]
+            if opcode == OP_LOAD_CONST:
+                lines.append(f'{pos:4} {OPCODE_NAMES[opcode]:10} {operand} ({self.constants[operand]})')
+            elif opcode in (OP_LOAD_VAR, OP_STORE_VAR):
+                lines.append(f'{pos:4} {OPCODE_NAMES[opcode]:10} {operand} ({self.names[operand]})')
+            else:
+                lines.append(f'{pos:4} {OPCODE_NAMES[opcode]}')
+        return '\n'.join(lines)
+
+
+class Compiler(CachedNodeVisitor):
+    """Lowers the AST to Bytecode, the visitor runs once per node here, not every time the program runs"""
+
+    def __init__(self):
+        self.code = []
+        self.constants = []
+        self.constant_indexes = {}
+        self.symbols = SymbolTable()
+        self.visitors = {}
+
+    def compile(self, tree):
+        self.visit(tree)
+        return Bytecode(self.code, self.constants, self.symbols.names)
+
+    def emit(self, opcode, operand=0):
+        self.code.append(opcode)
+        self.code.append(operand)
+
+    def visit_BinaryOperator(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY_OPCODES[node.op.type])
+
+    def visit_Num(self, node):
+        if node.value not in self.constant_indexes:
+            self.constant_indexes[node.value] = len(self.constants)
+            self.constants.append(node.value)
+        self.emit(OP_LOAD_CONST, self.constant_indexes[node.value])
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_Assignment(self, node):
+        self.visit(node.right)
+        self.emit(OP_STORE_VAR, self.symbols.define(node.left.value))
+
+    def visit_Variable(self, node):
+        self.emit(OP_LOAD_VAR, self.symbols.define(node.value))
+
+    def visit_NoOp(self, node):
+        pass
+
+
+class VirtualMachine:
+    """
+    Runs the Bytecode of a program on a stack, a drop-in for Interpreter
+
+    variables live in a list of slots while the program runs,
+    GLOBAL_SCOPE gets the ones that were assigned when it stops, in the order they were first assigned
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.GLOBAL_SCOPE = {}
+
+    def run(self, bytecode):
+        code, constants, names = bytecode.code, bytecode.constants, bytecode.names
+        slots = [UNSET] * len(names)
+        # slots in the order of their first assignment, like the keys of the tree walker's GLOBAL_SCOPE
+        assigned = []
+        stack = []
+        push, pop = stack.append, stack.pop
+        # there are no jumps, every instruction runs once, in order
+        instructions = iter(code)
+        try:
+            for opcode, operand in zip(instructions, instructions):
+                if opcode == OP_LOAD_VAR:
+                    value = slots[operand]
+                    if value is UNSET:
+                        raise NameError(repr(names[operand]))
+                    push(value)
+                elif opcode == OP_LOAD_CONST:
+                    push(constants[operand])
+                elif opcode == OP_STORE_VAR:
+                    if slots[operand] is UNSET:
+                        assigned.append(operand)
+                    slots[operand] = pop()
+                else:
+                    right = pop()
+                    if opcode == OP_ADD:
+                        stack[-1] += right
+                    elif opcode == OP_SUB:
+                        stack[-1] -= right
+                    elif opcode == OP_MUL:
+                        stack[-1] *= right
+                    else:
+                        stack[-1] //= right
+        finally:
+            self.GLOBAL_SCOPE = {names[slot]: slots[slot] for slot in assigned}
+
+    def eval(self):
+        tree = self.parser.parse()
+        self.run(Compiler().compile(tree))
+
+
 def repl():
     while True:
         try:
@@ -393,21 +635,30 @@ def repl():
         main(text)
 
 
-def main(text):
+def main(text, mode=None):
+    interpreters = {None: Interpreter, 'vm': VirtualMachine, 'slots': SlotInterpreter}
     try:
         tokenizer = Tokenizer(text)
         parser = Parser(tokenizer)
-        interpreter = Interpreter(parser)
+        interpreter = interpreters[mode](parser)
         result = interpreter.eval()
         print(result)
         print(interpreter.GLOBAL_SCOPE)
-    except (ParserError, TokenizerError, InterpreterError, NodeVisitorError) as e:
+    except (ParserError, TokenizerError, SemanticError, InterpreterError, NodeVisitorError) as e:
         print(e)
 
 
 if __name__ == '__main__':
     # repl()
-    import sys
-
-    text = open(sys.argv[1], 'r').read()
-    main(text)
+    import argparse
+
+    # python interpretty.py [--vm | --slots] pas.txt
+    arg_parser = argparse.ArgumentParser(description='run a pascal program, on the tree walking interpreter by default')
+    modes = arg_parser.add_mutually_exclusive_group()
+    modes.add_argument('--vm', dest='mode', action='store_const', const='vm', help='compile to bytecode and run it')
+    modes.add_argument('--slots', dest='mode', action='store_const', const='slots',
+                       help='resolve variables to slots first')
+    arg_parser.add_argument('path')
+    args = arg_parser.parse_args()
+    with open(args.path) as f:
+        main(f.read(), args.mode)
@@ -0,0 +1,878 @@
+"""
+benchmarks for tinysearch
+
+python benchmark.py compact --pages 1000000
+python benchmark.py pagerank --pages 200000 --teleport-rate 0.01
+python benchmark.py topk --pages 200000 --k 10
+python benchmark.py segment --pages 20000
+python benchmark.py build --pages 50000 --workers 8
+python benchmark.py fuzzy --words 1000 --dictionary big.txt
+python benchmark.py expand --terms 1000000 --max-distance 1
+python benchmark.py lexrank --sentences 5000 --threshold 0.3 --text big.txt
+python benchmark.py serve --pages 20000 --connections 32 --swap-every 2
+python benchmark.py pipeline --pages 1000 --delay 0.2
+python benchmark.py suite --pages 20000 --output results.json
+python benchmark.py tokenize --pages 20000 --text big.txt
+python benchmark.py bm25 --pages 20000
+python benchmark.py tiers --pages 20000 --k 10 --tier-sizes 64 256 1024
+"""
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import multiprocessing
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from collections import Counter
+import numpy as np
+
+
+def synthetic_index(number_of_pages, vocabulary_size, terms_per_page, seed=0):
+    """a normalized index shaped like Indexer.get_index output, without tokenizing anything"""
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(vocabulary_size)]
+    index = {}
+    for i in range(number_of_pages):
+        url = f"page{i}.com"
+        for term in rng.sample(vocabulary, terms_per_page):
+            index.setdefault(term, []).append((url, round(rng.random(), 3)))
+    return index
+
+
+def synthetic_link_pages(number_of_pages, links_per_page, locality=0.0, seed=0):
+    """
+    pages without content, every page links to random pages and some link nowhere
+
+    with locality, that share of the links stay within a site of 100 neighbouring pages,
+    like the links of real sites, which makes the ranks settle slower
+    """
+    rng = random.Random(seed)
+    urls = [f"page{i}.com" for i in range(number_of_pages)]
+    pages = []
+    for i, url in enumerate(urls):
+        site = urls[i - i % 100:i - i % 100 + 100]
+        links = [] if rng.random() < 0.05 else [
+            rng.choice(site) if rng.random() < locality else rng.choice(urls) for _ in range(links_per_page)
+        ]
+        pages.append((url, "", links))
+    return pages
+
+
+def synthetic_pages(number_of_pages, vocabulary_size, words_per_page, links_per_page, seed=0):
+    """pages with random words as content and random links"""
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+    urls = [f"page{i}.com" for i in range(number_of_pages)]
+    return [
+        (url, " ".join(rng.choices(vocabulary, k=words_per_page)), rng.choices(urls, k=links_per_page))
+        for url in urls
+    ]
+
+
+def zipf_weights(n, exponent):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def zipf_pages(number_of_pages, vocabulary_size, words_per_page, links_per_page, exponent=1.0, link_exponent=1.0,
+               seed=0):
+    """
+    pages of zipf distributed words, word0 is the most common one,
+    and a power law link graph, links go to page0 most often, then page1 and so on,
+    the number of links of a page varies around links_per_page and some pages link nowhere
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"word{i}" for i in range(vocabulary_size)], dtype=object)
+    urls = np.array([f"page{i}.com" for i in range(number_of_pages)], dtype=object)
+    word_ids = rng.choice(vocabulary_size, (number_of_pages, words_per_page), p=zipf_weights(vocabulary_size, exponent))
+    words = vocabulary[word_ids]
+    out_degrees = rng.poisson(links_per_page, number_of_pages)
+    targets = urls[rng.choice(number_of_pages, out_degrees.sum(), p=zipf_weights(number_of_pages, link_exponent))]
+    link_starts = np.cumsum(out_degrees) - out_degrees
+    return [
+        (url, " ".join(page_words), targets[start:start + out_degree].tolist())
+        for url, page_words, start, out_degree in zip(urls.tolist(), words, link_starts, out_degrees)
+    ]
+
+
+def dict_index_nbytes(index):
+    """deep size of a dict index, url strings are shared between postings so count them once"""
+    nbytes = sys.getsizeof(index)
+    urls = {}
+    for term, docs in index.items():
+        nbytes += sys.getsizeof(term) + sys.getsizeof(docs)
+        for posting in docs:
+            url, weight = posting
+            nbytes += sys.getsizeof(posting) + sys.getsizeof(weight)
+            urls[id(url)] = url
+    nbytes += sum(sys.getsizeof(url) for url in urls.values())
+    return nbytes
+
+
+def bench_compact(args):
+    from compact import CompactIndex
+
+    index = synthetic_index(args.pages, args.vocabulary, args.terms_per_page)
+    number_of_postings = sum(len(docs) for docs in index.values())
+    dict_nbytes = dict_index_nbytes(index)
+
+    start = time.perf_counter()
+    compact_index = CompactIndex.from_index(index)
+    build_seconds = time.perf_counter() - start
+
+    print(f"{args.pages} pages, {number_of_postings} postings, built compact index in {build_seconds:.1f}s")
+    print(f"dict index    {dict_nbytes / 2 ** 20:9.1f} MiB {dict_nbytes / number_of_postings:6.1f} bytes/posting")
+    print(f"compact index {compact_index.nbytes / 2 ** 20:9.1f} MiB "
+          f"{compact_index.nbytes / number_of_postings:6.1f} bytes/posting")
+
+
+def bench_pagerank(args):
+    from tinysearch import PageRank, Scorer
+    from solver import PowerIteration
+
+    pages = synthetic_link_pages(args.pages, args.links_per_page, args.locality)
+    start = time.perf_counter()
+    link_graph = PageRank(Scorer()).create_link_graph(pages)
+    graph_seconds = time.perf_counter() - start
+    print(f"{args.pages} pages, {len(link_graph.indices)} edges, link graph built in {graph_seconds:.1f}s")
+
+    # a few pages get new links, like after a recrawl
+    rng = random.Random(1)
+    changed_pages = list(pages)
+    for i in rng.sample(range(len(pages)), len(pages) // 100):
+        url, content, links = pages[i]
+        changed_pages[i] = (url, content, rng.choices([url for url, _, _ in pages], k=args.links_per_page))
+    changed_graph = PageRank(Scorer()).create_link_graph(changed_pages)
+
+    solvers = {
+        "power": PowerIteration(args.tolerance),
+        "extrapolation": PowerIteration(args.tolerance, extrapolate_every=10),
+    }
+    reference = None
+    for label, solver in solvers.items():
+        ranker = PageRank(Scorer(), solver)
+        ranker.teleport_rate = args.teleport_rate
+        ranks = np.array(ranker.sparse_power_method(len(pages), link_graph))
+        reference = ranks if reference is None else reference
+        cold = solver.stats
+        ranker.sparse_power_method(len(pages), changed_graph, ranks)
+        warm = solver.stats
+        print(f"{label:13} {cold.iterations:5} steps {cold.seconds:7.2f}s, "
+              f"warm start after 1% changed {warm.iterations:5} steps {warm.seconds:7.2f}s, "
+              f"L1 distance to power {np.abs(ranks - reference).sum():.1e}")
+
+
+def synthetic_engine(index, number_of_pages, seed=0):
+    """a search engine over an index from synthetic_index with random page ranks"""
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+
+    rng = random.Random(seed)
+    scorer = Scorer()
+    engine = SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+    engine.index = index
+    engine.number_of_pages = number_of_pages
+    engine.page_rank = {f"page{i}.com": rng.random() / number_of_pages for i in range(number_of_pages)}
+    return engine
+
+
+def bench_top_k(args):
+    index = synthetic_index(args.pages, args.vocabulary, args.terms_per_page)
+    engine = synthetic_engine(index, args.pages)
+    # the most common terms have the longest posting lists
+    terms = sorted(index, key=lambda term: len(index[term]), reverse=True)
+    queries = [" ".join(terms[i:i + 2]) for i in range(0, 20, 2)]
+    # sort the queried postings once, like a warm engine
+    engine.search(queries[0], k=args.k)
+    for query in queries:
+        engine.search(query, k=args.k)
+
+    for label, k in [("full sort", None), (f"top {args.k}", args.k)]:
+        start = time.perf_counter()
+        for query in queries:
+            engine.search(query, k=k)
+        seconds = (time.perf_counter() - start) / len(queries)
+        print(f"{label:10} {seconds * 1000:8.2f} ms/query")
+    print(f"{sum(len(index[term]) for term in terms[:20]) / 20:.0f} postings per query term")
+
+
+def bench_segment(args):
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+
+    def make_engine():
+        scorer = Scorer()
+        return SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+
+    pages = synthetic_pages(args.pages, args.vocabulary, args.words_per_page, args.links_per_page)
+    query = "word1 word2"
+
+    start = time.perf_counter()
+    engine = make_engine()
+    engine.start(pages)
+    engine.search(query)
+    start_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.seg")
+        engine.save(path)
+        size = os.path.getsize(path)
+        del engine
+
+        start = time.perf_counter()
+        engine = make_engine()
+        engine.open(path)
+        engine.search(query)
+        open_seconds = time.perf_counter() - start
+
+    print(f"{args.pages} pages, segment is {size / 2 ** 20:.1f} MiB")
+    print(f"start + first query {start_seconds * 1000:10.1f} ms")
+    print(f"open + first query  {open_seconds * 1000:10.1f} ms")
+
+
+def bench_build(args):
+    from tinysearch import Tokenizer, Scorer, Indexer
+
+    pages = synthetic_pages(args.pages, args.vocabulary, args.words_per_page, links_per_page=0)
+    indexer = Indexer(Tokenizer(set()), Scorer())
+
+    start = time.perf_counter()
+    indexer.get_posting_arrays(pages)
+    serial_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    indexer.get_sharded_posting_arrays(pages, args.workers)
+    sharded_seconds = time.perf_counter() - start
+
+    print(f"{args.pages} pages, counting terms")
+    print(f"1 process    {serial_seconds:8.2f}s")
+    print(f"{args.workers} processes {sharded_seconds:8.2f}s {serial_seconds / sharded_seconds:5.1f}x")
+
+
+def misspell(word, edits, rng):
+    """word with random deletes, transposes, replaces or inserts"""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    for _ in range(edits):
+        i = rng.randrange(len(word) + 1)
+        edit = rng.choice(["delete", "transpose", "replace", "insert"])
+        if edit == "delete" and i < len(word):
+            word = word[:i] + word[i + 1:]
+        elif edit == "transpose" and i + 1 < len(word):
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        elif edit == "replace" and i < len(word):
+            word = word[:i] + rng.choice(letters) + word[i + 1:]
+        else:
+            word = word[:i] + rng.choice(letters) + word[i:]
+    return word
+
+
+def bench_fuzzy(args):
+    import fuzzy
+
+    start = time.perf_counter()
+    corrector = fuzzy.SpellCorrector(args.dictionary, args.max_distance)
+    corrector.load(delete_index=False)
+    load_seconds = time.perf_counter() - start
+    corrector.load()
+    build_seconds = time.perf_counter() - start - load_seconds
+
+    rng = random.Random(0)
+    words = [word for word in corrector.words if 3 <= len(word) <= 12]
+    queries = [misspell(word, rng.choice([1, 2]), rng) for word in rng.sample(words, args.words)]
+
+    results = {}
+    for label, correction in [("edits", corrector.correction), ("delete index", corrector.fast_correction)]:
+        start = time.perf_counter()
+        results[label] = [correction(word) for word in queries]
+        seconds = (time.perf_counter() - start) / len(queries)
+        print(f"{label:12} {seconds * 1000:8.3f} ms/word")
+    # max picks any of the equally probable candidates, so a tie counts as the same answer
+    same = sum(corrector.P(a) == corrector.P(b) for a, b in zip(results["edits"], results["delete index"]))
+
+    delete_index = corrector.delete_index
+    print(f"{len(corrector.words)} words loaded in {load_seconds:.2f}s, {corrector.words.nbytes / 2 ** 20:.1f} MiB")
+    print(f"delete index built in {build_seconds:.1f}s, "
+          f"{len(delete_index.words)} keys, {delete_index.nbytes / 2 ** 20:.1f} MiB")
+    print(f"{same}/{len(queries)} corrections agree")
+
+
+def bench_expand(args):
+    from fuzzy import CompactDeleteIndex
+
+    rng = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    terms = list({"".join(rng.choices(letters, k=rng.randint(3, 12))) for _ in range(args.terms)})
+
+    start = time.perf_counter()
+    expander = CompactDeleteIndex(terms, args.max_distance)
+    build_seconds = time.perf_counter() - start
+
+    queries = [misspell(term, args.max_distance, rng) for term in rng.sample(terms, args.queries)]
+    start = time.perf_counter()
+    matches = sum(len(expander.lookup(query)) for query in queries)
+    seconds = (time.perf_counter() - start) / len(queries)
+
+    print(f"{len(terms)} terms, built in {build_seconds:.1f}s, {len(expander.hashes)} deletes, "
+          f"{expander.nbytes / 2 ** 20:.1f} MiB")
+    print(f"{seconds * 1000:.3f} ms/lookup, {matches / len(queries):.1f} terms within {args.max_distance} edits")
+
+
+def synthetic_text(number_of_sentences, vocabulary_size, seed=0):
+    """sentences of zipf distributed words, word0 is the most common one"""
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+    frequencies = [1 / (i + 1) for i in range(vocabulary_size)]
+    return " ".join(
+        " ".join(rng.choices(vocabulary, frequencies, k=rng.randint(5, 25))) + "."
+        for _ in range(number_of_sentences)
+    )
+
+
+def bench_lexrank(args):
+    from tinysearch import Tokenizer, Scorer, PageRank
+    from lexrank import LexRank, split_sentences
+
+    if args.text:
+        with open(args.text) as file:
+            text = " ".join(split_sentences(file.read())[:args.sentences])
+        counts = Counter(Tokenizer(set()).token_generator(text))
+        stop_words = {word for word, count in counts.most_common(args.stop_words)}
+    else:
+        text = synthetic_text(args.sentences, args.vocabulary)
+        # the most common words play the stop words
+        stop_words = {f"word{i}" for i in range(args.stop_words)}
+    scorer = Scorer()
+    sentences = split_sentences(text)
+    print(f"{len(sentences)} sentences, threshold {args.threshold}")
+
+    summaries, edges, ranks = {}, {}, {}
+    for approximate in (False, True):
+        lexrank = LexRank(Tokenizer(stop_words), scorer, PageRank(scorer), args.threshold, approximate, args.bands,
+                          args.rows)
+        start = time.perf_counter()
+        graph = lexrank.get_similarity_graph(sentences)
+        graph_seconds = time.perf_counter() - start
+        summaries[approximate] = set(lexrank.summarize(text, args.summary_sentences))
+        seconds = time.perf_counter() - start - graph_seconds
+        ranks[approximate] = np.argsort(np.argsort(lexrank.rank_sentences(sentences)))
+        # links besides the self loops
+        sources = np.repeat(np.arange(len(sentences)), np.diff(graph.indptr))
+        edges[approximate] = set((sources * len(sentences) + graph.indices)[sources != graph.indices].tolist())
+        label = "approximate" if approximate else "exact"
+        print(f"{label:11} graph {graph_seconds * 1000:9.1f} ms, summary {seconds * 1000:9.1f} ms, "
+              f"{len(edges[approximate])} edges")
+
+    found = len(edges[True] & edges[False]) / max(len(edges[False]), 1)
+    overlap = len(summaries[True] & summaries[False]) / args.summary_sentences
+    correlation = np.corrcoef(ranks[True], ranks[False])[0, 1]
+    print(f"approximate graph has {found:.1%} of the edges, summaries share {overlap:.0%} of their sentences, "
+          f"rank correlation {correlation:.3f}")
+
+
+def serve_synthetic_engine(args, ports):
+    """runs in its own process, so the clients don't take turns with the server"""
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+    from service import SearchService
+
+    def make_engine():
+        scorer = Scorer()
+        engine = SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+        engine.start(synthetic_pages(args.pages, args.vocabulary, args.words_per_page, args.links_per_page))
+        engine.search("word0", k=1)
+        return engine
+
+    async def main():
+        service = SearchService(make_engine())
+        await service.start(port=0)
+        ports.put(service.port)
+        async with service.server:
+            while args.swap_every:
+                await asyncio.sleep(args.swap_every)
+                await service.rebuild(make_engine)
+                print(f"swapped in engine {service.swaps}")
+            await service.server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def search_client(port, queries, latencies):
+    """queries one at a time on a kept alive connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for query in queries:
+        start = time.perf_counter()
+        writer.write(f"GET /search?q={query}&k=10 HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        status = (await reader.readline()).split()[1]
+        length = 0
+        while (line := await reader.readline()) != b"\r\n":
+            if line.lower().startswith(b"content-length"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+        if status != b"200":
+            raise RuntimeError(f"{query} got {status}")
+    writer.close()
+
+
+def bench_serve(args):
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_synthetic_engine, args=(args, ports), daemon=True)
+    server.start()
+    port = ports.get()
+
+    rng = random.Random(1)
+    queries = [f"word{rng.randrange(args.vocabulary)}+word{rng.randrange(args.vocabulary)}"
+               for _ in range(args.requests)]
+    latencies = []
+
+    async def main():
+        clients = [search_client(port, queries[i::args.connections], latencies) for i in range(args.connections)]
+        await asyncio.gather(*clients)
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    seconds = time.perf_counter() - start
+    server.terminate()
+
+    latencies = np.array(latencies) * 1000
+    print(f"{args.pages} pages, {args.requests} queries on {args.connections} connections")
+    print(f"{len(latencies) / seconds:8.0f} queries/s, p50 {np.percentile(latencies, 50):.2f} ms, "
+          f"p99 {np.percentile(latencies, 99):.2f} ms, max {latencies.max():.2f} ms")
+
+
+def serve_synthetic_site(args, ports):
+    """runs in its own process, a site of html pages that each take delay seconds to come"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    vocabulary = [f"word{i}" for i in range(args.vocabulary)]
+
+    class SiteHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            i = int(self.path.strip("/") or 0)
+            rng = random.Random(i)
+            # the next page too, so every page is found
+            links = [(i + 1) % args.pages] + rng.choices(range(args.pages), k=args.links_per_page)
+            words = " ".join(rng.choices(vocabulary, k=args.words_per_page))
+            anchors = "".join(f'<a href="/{link}">{link}</a>' for link in links)
+            body = f"<html><body><p>{words}</p>{anchors}</body></html>".encode()
+            time.sleep(args.delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    # the default backlog of 5 drops connections and the crawler waits a second to retry
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def bench_pipeline(args):
+    from tinysearch import make_search_engine
+    from pipeline import AsyncCrawler, crawl_and_index
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_synthetic_site, args=(args, ports), daemon=True)
+    server.start()
+    start_url = f"http://127.0.0.1:{ports.get()}/0"
+
+    async def crawl():
+        pages = asyncio.Queue()
+        await AsyncCrawler(args.max_concurrency, pages).run(start_url)
+        return [page for page in (pages.get_nowait() for _ in range(pages.qsize())) if page is not None]
+
+    start = time.perf_counter()
+    pages = asyncio.run(crawl())
+    crawl_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = make_search_engine()
+    for page in pages:
+        engine.add_pages([page])
+    index_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = make_search_engine()
+    number_of_pages = asyncio.run(
+        crawl_and_index(engine, start_url, args.queue_size, args.max_concurrency)
+    )
+    pipeline_seconds = time.perf_counter() - start
+    server.terminate()
+
+    print(f"{len(pages)} pages crawled, {number_of_pages} through the pipeline")
+    print(f"crawl {crawl_seconds:.2f}s, index {index_seconds:.2f}s, one after the other "
+          f"{crawl_seconds + index_seconds:.2f}s, the longer one {max(crawl_seconds, index_seconds):.2f}s")
+    print(f"pipeline {pipeline_seconds:.2f}s")
+
+
+def measure(function, *args, repeats=1):
+    """seconds of every run, and the peak traced memory of one more run"""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    # tracing slows everything down, so memory gets a run of its own
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def latency_summary(seconds):
+    milliseconds = np.array(seconds) * 1000
+    return {
+        "runs": len(milliseconds),
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p90_ms": float(np.percentile(milliseconds, 90)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+
+    start = time.perf_counter()
+    pages = zipf_pages(args.pages, args.vocabulary, args.words_per_page, args.links_per_page, args.exponent,
+                       args.link_exponent, args.seed)
+    corpus_seconds = time.perf_counter() - start
+    corpus_bytes = sum(len(content) for url, content, links in pages)
+    print(f"{args.pages} pages, {corpus_bytes / 2 ** 20:.1f} MiB of text, generated in {corpus_seconds:.1f}s",
+          file=sys.stderr)
+
+    scorer = Scorer()
+    indexer = Indexer(Tokenizer(set()), scorer)
+    ranker = PageRank(scorer)
+    results = {}
+
+    seconds, peak = measure(indexer.get_index, pages, repeats=args.repeats)
+    results["get_index"] = {
+        **latency_summary(seconds),
+        "pages_per_second": args.pages / min(seconds),
+        "mb_per_second": corpus_bytes / 2 ** 20 / min(seconds),
+        "peak_memory_mb": peak / 2 ** 20,
+    }
+
+    seconds, peak = measure(ranker.create_page_rank, pages, repeats=args.repeats)
+    results["create_page_rank"] = {
+        **latency_summary(seconds),
+        "pages_per_second": args.pages / min(seconds),
+        "iterations": ranker.solver.stats.iterations,
+        "edges": sum(len(links) for url, content, links in pages),
+        "peak_memory_mb": peak / 2 ** 20,
+    }
+
+    engine = SearchEngine(indexer, ranker)
+    engine.start(pages)
+    # queries of 1 to 3 words, common words come up as often as in the pages
+    rng = np.random.default_rng(args.seed + 1)
+    query_words = rng.choice(args.vocabulary, 3 * args.queries, p=zipf_weights(args.vocabulary, args.exponent))
+    queries = [
+        " ".join(f"word{i}" for i in query_words[3 * q:3 * q + length])
+        for q, length in enumerate(rng.integers(1, 4, args.queries))
+    ]
+    for label, k in [("search", None), (f"search_top_{args.k}", args.k)]:
+        # impact index and sorted postings are built on the first query
+        engine.search(queries[0], k=k)
+
+        def search_all():
+            for query in queries:
+                engine.search(query, k=k)
+
+        seconds = []
+        for query in queries:
+            start = time.perf_counter()
+            engine.search(query, k=k)
+            seconds.append(time.perf_counter() - start)
+        _, peak = measure(search_all, repeats=0)
+        results[label] = {
+            **latency_summary(seconds),
+            "queries_per_second": len(seconds) / sum(seconds),
+            "peak_memory_mb": peak / 2 ** 20,
+        }
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "config": {name: value for name, value in vars(args).items() if name not in ("run", "command", "output")},
+        "corpus": {"bytes": corpus_bytes, "generate_seconds": corpus_seconds},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def bench_tokenize(args):
+    from tinysearch import Tokenizer, Scorer, Indexer, Vocabulary
+
+    if args.text:
+        with open(args.text) as file:
+            words = file.read().split(" ")
+        words_per_page = max(1, len(words) // args.pages)
+        pages = [(f"page{i}.com", " ".join(words[i * words_per_page:(i + 1) * words_per_page]), [])
+                 for i in range(args.pages)]
+    else:
+        pages = zipf_pages(args.pages, args.vocabulary, args.words_per_page, links_per_page=0)
+    contents = [content for url, content, links in pages]
+    megabytes = sum(len(content.encode()) for content in contents) / 2 ** 20
+    indexer = Indexer(Tokenizer({"the", "a", "an", "is", "this", "to"}), Scorer())
+    print(f"{len(pages)} pages, {megabytes:.1f} MiB")
+
+    def tokenize_generator():
+        for content in contents:
+            indexer.get_counts(content)
+
+    def tokenize_bulk():
+        vocabulary = Vocabulary(indexer.tokenizer.stop_words)
+        for i in range(0, len(contents), args.batch_size):
+            indexer.tokenizer.bulk_tokenize(contents[i:i + args.batch_size], vocabulary)
+
+    runs = [
+        ("generator + Counter", tokenize_generator),
+        ("bulk term ids", tokenize_bulk),
+        ("count index + to_arrays", lambda: indexer.to_arrays(indexer.get_count_index(pages))),
+        ("get_posting_arrays", lambda: indexer.get_posting_arrays(pages, args.batch_size)),
+    ]
+    for label, run in runs:
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        print(f"{label:24} {seconds:7.2f}s {megabytes / seconds:7.1f} MB/s")
+
+
+def bench_bm25(args):
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+    from bm25 import BM25
+
+    def make_engine(scorer):
+        return SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+
+    pages = zipf_pages(args.pages, args.vocabulary, args.words_per_page, args.links_per_page)
+    rng = np.random.default_rng(1)
+    query_words = rng.choice(args.vocabulary, args.queries, p=zipf_weights(args.vocabulary, 1.0))
+    # not the most common words, they are in almost every page
+    queries = [f"word{i + 10} word{i + 100}" for i in query_words]
+    print(f"{args.pages} pages, {args.queries} queries")
+
+    def time_queries(engine, label):
+        engine.search(queries[0])
+        start = time.perf_counter()
+        for query in queries:
+            engine.search(query)
+        print(f"{label:36} {(time.perf_counter() - start) / len(queries) * 1000:8.2f} ms/query")
+
+    for label, scorer in [("tf-idf", Scorer()), ("bm25", BM25())]:
+        start = time.perf_counter()
+        engine = make_engine(scorer)
+        engine.start(pages)
+        print(f"{label:6} start {time.perf_counter() - start:6.2f}s, {type(engine.index).__name__}")
+        time_queries(engine, f"{label} built index")
+        engine = make_engine(scorer)
+        engine.add_pages(pages)
+        time_queries(engine, f"{label} incremental index")
+
+    # titles, a few words from each page
+    titles = [(url, " ".join(content.split()[:args.title_words])) for url, content, links in pages]
+    engine = make_engine(BM25())
+    engine.start(pages)
+    start = time.perf_counter()
+    engine.add_field("title", titles, weight=2)
+    print(f"adding a title field {time.perf_counter() - start:6.2f}s")
+    time_queries(engine, "bm25f content + title")
+
+
+def bench_tiers(args):
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+
+    pages = zipf_pages(args.pages, args.vocabulary, args.words_per_page, args.links_per_page)
+    scorer = Scorer()
+    engine = SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+    engine.start(pages)
+    # queries of 1 to 3 words, common words come up as often as in the pages
+    rng = np.random.default_rng(1)
+    query_words = rng.choice(args.vocabulary, 3 * args.queries, p=zipf_weights(args.vocabulary, 1.0))
+    queries = [
+        " ".join(f"word{i}" for i in query_words[3 * q:3 * q + length])
+        for q, length in enumerate(rng.integers(1, 4, args.queries))
+    ]
+    print(f"{args.pages} pages, {args.queries} queries, top {args.k}")
+
+    def time_queries(k):
+        # sorted postings are built on the first query of every term, not timed
+        results = [engine.search(query, k=k) for query in queries]
+        start = time.perf_counter()
+        for query in queries:
+            engine.search(query, k=k)
+        return (time.perf_counter() - start) / len(queries) * 1000, results
+
+    full_ms, _ = time_queries(None)
+    print(f"{'full search':28} {full_ms:8.2f} ms/query")
+    threshold_ms, expected = time_queries(args.k)
+    print(f"{'threshold algorithm':28} {threshold_ms:8.2f} ms/query")
+    for tier_size in args.tier_sizes:
+        engine.tier_size = tier_size
+        engine.tiered_index = None
+        ms, results = time_queries(args.k)
+        tiered_index = engine.tiered_index
+        same = all(
+            len(top) == len(expected_top) and np.allclose([score for url, score in top],
+                                                          [score for url, score in expected_top])
+            for top, expected_top in zip(results, expected)
+        )
+        print(f"{f'tiers of {tier_size}':28} {ms:8.2f} ms/query, "
+              f"{tiered_index.first_tier_answers / tiered_index.queries:6.1%} from the first tier, "
+              f"{threshold_ms / ms:5.1f}x the threshold algorithm, {full_ms / ms:5.1f}x full search, "
+              f"{'same' if same else 'different'} scores")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact = commands.add_parser("compact", help="memory footprint of dict vs compact index")
+    compact.add_argument("--pages", type=int, default=1_000_000)
+    compact.add_argument("--vocabulary", type=int, default=50_000)
+    compact.add_argument("--terms-per-page", type=int, default=10)
+    compact.set_defaults(run=bench_compact)
+
+    pagerank = commands.add_parser("pagerank", help="power iteration with and without extrapolation, cold and warm")
+    pagerank.add_argument("--pages", type=int, default=500_000)
+    pagerank.add_argument("--links-per-page", type=int, default=10)
+    pagerank.add_argument("--teleport-rate", type=float, default=0.1)
+    pagerank.add_argument("--tolerance", type=float, default=1e-10)
+    pagerank.add_argument("--locality", type=float, default=0.99)
+    pagerank.set_defaults(run=bench_pagerank)
+
+    top_k = commands.add_parser("topk", help="full search vs top k search on common terms")
+    top_k.add_argument("--pages", type=int, default=200_000)
+    top_k.add_argument("--vocabulary", type=int, default=2_000)
+    top_k.add_argument("--terms-per-page", type=int, default=10)
+    top_k.add_argument("--k", type=int, default=10)
+    top_k.set_defaults(run=bench_top_k)
+
+    segment = commands.add_parser("segment", help="cold start from pages vs opening a saved segment")
+    segment.add_argument("--pages", type=int, default=20_000)
+    segment.add_argument("--vocabulary", type=int, default=20_000)
+    segment.add_argument("--words-per-page", type=int, default=100)
+    segment.add_argument("--links-per-page", type=int, default=5)
+    segment.set_defaults(run=bench_segment)
+
+    build = commands.add_parser("build", help="serial vs sharded term counting")
+    build.add_argument("--pages", type=int, default=50_000)
+    build.add_argument("--vocabulary", type=int, default=20_000)
+    build.add_argument("--words-per-page", type=int, default=300)
+    build.add_argument("--workers", type=int, default=os.cpu_count())
+    build.set_defaults(run=bench_build)
+
+    fuzzy = commands.add_parser("fuzzy", help="spelling correction by generated edits vs the delete index")
+    fuzzy.add_argument("--words", type=int, default=1_000)
+    fuzzy.add_argument("--max-distance", type=int, default=2)
+    fuzzy.add_argument("--dictionary", default="big.txt", help="a text or a table saved by fuzzy.py")
+    fuzzy.set_defaults(run=bench_fuzzy)
+
+    expand = commands.add_parser("expand", help="index terms within k edits of a query term")
+    expand.add_argument("--terms", type=int, default=1_000_000)
+    expand.add_argument("--max-distance", type=int, default=1)
+    expand.add_argument("--queries", type=int, default=1_000)
+    expand.set_defaults(run=bench_expand)
+
+    lexrank = commands.add_parser("lexrank", help="exact vs approximate summary of a long text")
+    lexrank.add_argument("--sentences", type=int, default=5_000)
+    lexrank.add_argument("--vocabulary", type=int, default=3_000)
+    lexrank.add_argument("--stop-words", type=int, default=30)
+    lexrank.add_argument("--threshold", type=float, default=0.1)
+    lexrank.add_argument("--summary-sentences", type=int, default=10)
+    lexrank.add_argument("--bands", type=int, default=64, help="of minhashes in the approximate mode")
+    lexrank.add_argument("--rows", type=int, default=2, help="minhashes per band")
+    lexrank.add_argument("--text", help="sentences of a text instead of zipf words")
+    lexrank.set_defaults(run=bench_lexrank)
+
+    serve = commands.add_parser("serve", help="queries per second and latency of the http service")
+    serve.add_argument("--pages", type=int, default=20_000)
+    serve.add_argument("--vocabulary", type=int, default=20_000)
+    serve.add_argument("--words-per-page", type=int, default=100)
+    serve.add_argument("--links-per-page", type=int, default=5)
+    serve.add_argument("--requests", type=int, default=20_000)
+    serve.add_argument("--connections", type=int, default=32)
+    serve.add_argument("--swap-every", type=float, default=0, help="seconds between index rebuilds, 0 for none")
+    serve.set_defaults(run=bench_serve)
+
+    pipeline = commands.add_parser("pipeline", help="crawl then index vs crawling and indexing at the same time")
+    pipeline.add_argument("--pages", type=int, default=1_000)
+    pipeline.add_argument("--vocabulary", type=int, default=20_000)
+    pipeline.add_argument("--words-per-page", type=int, default=3_000)
+    pipeline.add_argument("--links-per-page", type=int, default=5)
+    pipeline.add_argument("--delay", type=float, default=0.2, help="seconds the site takes to answer")
+    pipeline.add_argument("--max-concurrency", type=int, default=16)
+    pipeline.add_argument("--queue-size", type=int, default=256)
+    pipeline.set_defaults(run=bench_pipeline)
+
+    suite = commands.add_parser("suite", help="index, page rank and search on a zipf corpus, as json")
+    suite.add_argument("--pages", type=int, default=20_000)
+    suite.add_argument("--vocabulary", type=int, default=50_000)
+    suite.add_argument("--words-per-page", type=int, default=200)
+    suite.add_argument("--links-per-page", type=int, default=10)
+    suite.add_argument("--exponent", type=float, default=1.0, help="of the zipf distribution of words")
+    suite.add_argument("--link-exponent", type=float, default=1.0, help="of the power law of links to a page")
+    suite.add_argument("--queries", type=int, default=1_000)
+    suite.add_argument("--k", type=int, default=10)
+    suite.add_argument("--repeats", type=int, default=3)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--output", help="json file, defaults to stdout")
+    suite.set_defaults(run=bench_suite)
+
+    tokenize = commands.add_parser("tokenize", help="tokenizer generator vs bulk term ids, in MB/s")
+    tokenize.add_argument("--pages", type=int, default=20_000)
+    tokenize.add_argument("--vocabulary", type=int, default=50_000)
+    tokenize.add_argument("--words-per-page", type=int, default=300)
+    tokenize.add_argument("--batch-size", type=int, default=1024)
+    tokenize.add_argument("--text", help="split a text into the pages instead of zipf words")
+    tokenize.set_defaults(run=bench_tokenize)
+
+    bm25 = commands.add_parser("bm25", help="tf-idf vs bm25 weights, built and incremental, and a title field")
+    bm25.add_argument("--pages", type=int, default=20_000)
+    bm25.add_argument("--vocabulary", type=int, default=50_000)
+    bm25.add_argument("--words-per-page", type=int, default=200)
+    bm25.add_argument("--links-per-page", type=int, default=10)
+    bm25.add_argument("--title-words", type=int, default=5)
+    bm25.add_argument("--queries", type=int, default=200)
+    bm25.set_defaults(run=bench_bm25)
+
+    tiers = commands.add_parser("tiers", help="top k from the first tiers of impact ordered postings vs the rest")
+    tiers.add_argument("--pages", type=int, default=20_000)
+    tiers.add_argument("--vocabulary", type=int, default=50_000)
+    tiers.add_argument("--words-per-page", type=int, default=200)
+    tiers.add_argument("--links-per-page", type=int, default=10)
+    tiers.add_argument("--queries", type=int, default=1_000)
+    tiers.add_argument("--k", type=int, default=10)
+    tiers.add_argument("--tier-sizes", type=int, nargs="+", default=[64, 256, 1024])
+    tiers.set_defaults(run=bench_tiers)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
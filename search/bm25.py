@@ -0,0 +1,145 @@
+"""
+BM25 and BM25F scoring for tinysearch
+
+a page scores idf(term) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average length)) for every query term,
+a term stops adding up after a few occurrences and long pages don't win by repeating it
+
+BM25F adds up the frequencies of a term over the fields of a page first, like its body, its title
+or the anchor text of links to it, each field with its own weight and length normalization, then saturates the sum
+
+norms of the pages and idfs of the terms are arrays computed once,
+so weighting the postings of a term is a gather and a multiply, not a python call per posting
+"""
+from collections import namedtuple
+import numpy as np
+
+
+class BM25:
+    """a scorer like tinysearch.Scorer, the idf is in the page weights so every query term weighs the same"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        # how fast repeated terms stop adding up
+        self.k1 = k1
+        # how much longer pages are pulled down, 0 is not at all
+        self.b = b
+
+    @staticmethod
+    def get_idfs(number_of_pages, dfs):
+        # 1 + keeps terms in more than half of the pages from going negative
+        return np.log(1 + (number_of_pages - dfs + 0.5) / (dfs + 0.5))
+
+    def get_norms(self, lengths, average_length, b=None):
+        b = self.b if b is None else b
+        return 1 - b + b * lengths / (average_length or 1)
+
+    def saturate(self, tfs):
+        """tfs are already divided by the norms of their pages"""
+        return tfs * (self.k1 + 1) / (tfs + self.k1)
+
+    def get_weights(self, posting_arrays, number_of_pages, normalize=True):
+        """like Scorer.get_weights, bm25 weights are never normalized, long pages are already pulled down"""
+        terms, urls, term_ids, doc_ids, counts = posting_arrays
+        dfs = np.bincount(term_ids, minlength=len(terms))
+        lengths = np.bincount(doc_ids, weights=counts, minlength=len(urls))
+        norms = self.get_norms(lengths, lengths.sum() / number_of_pages if number_of_pages else 0)
+        return self.get_idfs(number_of_pages, dfs)[term_ids] * self.saturate(counts / norms[doc_ids])
+
+    def get_query_weights(self, dfs, number_of_pages):
+        return {term: 1.0 for term in dfs}
+
+    def get_postings(self, index, term):
+        """weighted postings of a term of a tinysearch.IncrementalIndex"""
+        docs = index.postings[term]
+        urls = list(docs)
+        counts = np.fromiter(docs.values(), dtype=np.float64, count=len(docs))
+        lengths = np.fromiter(map(index.doc_lengths.__getitem__, urls), dtype=np.float64, count=len(urls))
+        norms = self.get_norms(lengths, index.total_length / index.number_of_pages)
+        weights = self.get_idfs(index.number_of_pages, len(docs)) * self.saturate(counts / norms)
+        return list(zip(urls, weights.tolist()))
+
+
+# postings of term t are doc_ids[offsets[t]:offsets[t + 1]], their counts divided by the norms of their pages in tfs
+Field = namedtuple("Field", ["term_ids", "offsets", "doc_ids", "tfs", "weight"])
+
+
+class FieldIndex:
+    """
+    a BM25F index over named fields of the pages, index[term] gives (url, weight) pairs like any other index
+
+    every field keeps its own normalized counts, so adding a field, like titles, doesn't tokenize the others again,
+    the postings of a term are weighted over the fields when it's queried
+    """
+
+    def __init__(self, scorer, urls):
+        self.scorer = scorer
+        self.urls = list(urls)
+        # doc ids of every field are positions in urls
+        self.doc_ids = {url: doc_id for doc_id, url in enumerate(self.urls)}
+        self.fields = {}
+        # number of terms over all fields, counted once after a field is added
+        self.number_of_terms = None
+
+    def add_field(self, name, posting_arrays, weight=1.0, b=None):
+        """
+        counts of a field from Indexer.get_posting_arrays, urls the index doesn't have are left out,
+        the field replaces an older field of the same name
+        """
+        terms, urls, term_ids, doc_ids, counts = posting_arrays
+        to_index_doc_ids = np.array([self.doc_ids.get(url, -1) for url in urls], dtype=np.int64)
+        known = to_index_doc_ids[doc_ids] >= 0
+        term_ids, doc_ids, counts = term_ids[known], to_index_doc_ids[doc_ids[known]], counts[known]
+
+        lengths = np.bincount(doc_ids, weights=counts, minlength=len(self.urls))
+        # pages without the field don't pull the average down
+        has_field = np.count_nonzero(lengths)
+        norms = self.scorer.get_norms(lengths, lengths.sum() / has_field if has_field else 0, b)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        has_postings = np.diff(offsets) > 0
+        field_term_ids = {term: term_id for term_id, term in enumerate(terms) if has_postings[term_id]}
+        self.fields[name] = Field(field_term_ids, offsets, doc_ids, counts / norms[doc_ids], weight)
+        self.number_of_terms = None
+
+    def get_tfs(self, term):
+        """doc ids of the pages with the term in any field and their weighted, normalized term frequencies"""
+        doc_ids, tfs = [], []
+        for field in self.fields.values():
+            term_id = field.term_ids.get(term)
+            if term_id is not None:
+                start, end = field.offsets[term_id], field.offsets[term_id + 1]
+                doc_ids.append(field.doc_ids[start:end])
+                tfs.append(field.weight * field.tfs[start:end])
+        if not doc_ids:
+            raise KeyError(term)
+        if len(doc_ids) == 1:
+            # a page has a term at most once in a field, in doc id order
+            return doc_ids[0], tfs[0]
+        # a page with the term in more fields adds up its frequencies
+        doc_ids = np.concatenate(doc_ids)
+        has_term = np.bincount(doc_ids, minlength=len(self.urls)) > 0
+        tfs = np.bincount(doc_ids, weights=np.concatenate(tfs), minlength=len(self.urls))
+        doc_ids = np.flatnonzero(has_term)
+        return doc_ids, tfs[doc_ids]
+
+    def arrays(self, term):
+        """doc ids and weights of the postings of a term, doc ids are positions in urls"""
+        doc_ids, tfs = self.get_tfs(term)
+        return doc_ids, self.scorer.get_idfs(len(self.urls), len(doc_ids)) * self.scorer.saturate(tfs)
+
+    def df(self, term):
+        return len(self.get_tfs(term)[0]) if term in self else 0
+
+    def __getitem__(self, term):
+        doc_ids, weights = self.arrays(term)
+        return list(zip(map(self.urls.__getitem__, doc_ids.tolist()), weights.tolist()))
+
+    def __contains__(self, term):
+        return any(term in field.term_ids for field in self.fields.values())
+
+    def __iter__(self):
+        return iter(dict.fromkeys(term for field in self.fields.values() for term in field.term_ids))
+
+    def __len__(self):
+        if self.number_of_terms is None:
+            self.number_of_terms = sum(1 for _ in self)
+        return self.number_of_terms
@@ -0,0 +1,211 @@
+"""
+compact inverted index backed by numpy arrays
+
+terms and urls live in sorted string tables, so term ids and doc ids are just positions
+postings of a term are its doc ids, delta encoded and packed as varints, plus a float32 weight each
+"""
+import bisect
+import numpy as np
+
+
+def encode_varints(values):
+    """LEB128: 7 bits per byte, high bit set on every byte but the last one of a value"""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    buffer = np.zeros(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        mask = lengths > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        has_more = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        buffer[starts[mask] + k] = chunk | has_more
+    return buffer, lengths
+
+
+def decode_varints(buffer):
+    buffer = np.asarray(buffer, dtype=np.uint8)
+    if not len(buffer):
+        return np.zeros(0, dtype=np.int64)
+    is_last = buffer < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], is_last[:-1])))
+    groups = np.cumsum(np.concatenate(([0], is_last[:-1])))
+    shifts = (np.arange(len(buffer)) - starts[groups]) * 7
+    chunks = (buffer & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(chunks, starts).astype(np.int64)
+
+
+def sorted_positions(strings):
+    """position of every string once the list is sorted"""
+    order = sorted(range(len(strings)), key=strings.__getitem__)
+    positions = np.empty(len(strings), dtype=np.int64)
+    positions[order] = np.arange(len(strings))
+    return positions
+
+
+class StringTable:
+    """sorted strings packed into one utf-8 buffer, looked up by binary search"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode() for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, s):
+        i = bisect.bisect_left(self, s)
+        if i < len(self) and self[i] == s:
+            return i
+        return -1
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+
+class CompactIndex:
+    """
+    read-only drop-in for the dict index built by Indexer.get_index
+
+    index[term] still returns a list of (url, weight) pairs,
+    postings(term_id) returns the raw (doc_ids, weights) arrays
+    """
+
+    def __init__(self, terms, urls, posting_offsets, byte_offsets, gaps, weights):
+        self.terms = terms
+        self.urls = urls
+        # postings of term t are posting_offsets[t]:posting_offsets[t+1] in weights
+        self.posting_offsets = posting_offsets
+        # and byte_offsets[t]:byte_offsets[t+1] in gaps
+        self.byte_offsets = byte_offsets
+        self.gaps = gaps
+        self.weights = weights
+
+    @classmethod
+    def from_arrays(cls, terms, urls, term_ids, doc_ids, weights):
+        """build from (term id, doc id, weight) triples, ids point into the terms and urls lists"""
+        # renumber terms and urls in sorted order
+        term_ids = sorted_positions(terms)[np.asarray(term_ids, dtype=np.int64)]
+        doc_ids = sorted_positions(urls)[np.asarray(doc_ids, dtype=np.int64)]
+        terms, urls = sorted(terms), sorted(urls)
+
+        order = np.lexsort((doc_ids, term_ids))
+        term_ids, doc_ids = term_ids[order], doc_ids[order]
+        weights = np.asarray(weights, dtype=np.float32)[order]
+
+        posting_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=posting_offsets[1:])
+
+        # first doc id of every term is stored as is, the rest as gaps
+        gaps = np.diff(doc_ids, prepend=0)
+        firsts = posting_offsets[:-1][posting_offsets[:-1] < posting_offsets[1:]]
+        gaps[firsts] = doc_ids[firsts]
+        buffer, lengths = encode_varints(gaps)
+
+        byte_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        byte_ends = np.cumsum(lengths)
+        byte_offsets[1:] = np.concatenate(([0], byte_ends))[posting_offsets[1:]]
+
+        return cls(
+            StringTable.from_strings(terms),
+            StringTable.from_strings(urls),
+            posting_offsets,
+            byte_offsets,
+            buffer,
+            weights,
+        )
+
+    @classmethod
+    def from_index(cls, index, urls=None):
+        """urls is the doc table, defaults to every url in the index"""
+        terms = list(index)
+        if urls is None:
+            urls = list({url: None for docs in index.values() for url, weight in docs})
+        doc_id_by_url = {url: doc_id for doc_id, url in enumerate(urls)}
+
+        term_ids, doc_ids, weights = [], [], []
+        for term_id, term in enumerate(terms):
+            for url, weight in index[term]:
+                term_ids.append(term_id)
+                doc_ids.append(doc_id_by_url[url])
+                weights.append(weight)
+
+        return cls.from_arrays(terms, urls, term_ids, doc_ids, weights)
+
+    def term_id(self, term):
+        return self.terms.find(term)
+
+    def postings(self, term_id):
+        start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+        gaps = decode_varints(self.gaps[self.byte_offsets[term_id]:self.byte_offsets[term_id + 1]])
+        return np.cumsum(gaps), self.weights[start:end]
+
+    def arrays(self, term):
+        """postings of a term as (doc_ids, weights) arrays, doc ids are positions in urls"""
+        term_id = self.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        return self.postings(term_id)
+
+    def df(self, term):
+        term_id = self.term_id(term)
+        if term_id < 0:
+            return 0
+        return int(self.posting_offsets[term_id + 1] - self.posting_offsets[term_id])
+
+    def __contains__(self, term):
+        return self.term_id(term) >= 0
+
+    def __getitem__(self, term):
+        term_id = self.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        doc_ids, weights = self.postings(term_id)
+        return [(self.urls[doc_id], weight) for doc_id, weight in zip(doc_ids.tolist(), weights.tolist())]
+
+    def get(self, term, default=None):
+        return self[term] if term in self else default
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return iter(self.terms)
+
+    @property
+    def number_of_postings(self):
+        return len(self.weights)
+
+    @property
+    def nbytes(self):
+        return (
+            self.terms.nbytes
+            + self.urls.nbytes
+            + self.posting_offsets.nbytes
+            + self.byte_offsets.nbytes
+            + self.gaps.nbytes
+            + self.weights.nbytes
+        )
@@ -1,35 +1,306 @@
 """
 from https://norvig.com/spell-correct.html
+
+the dictionary is only read on the first correction, see SpellCorrector
+
+python fuzzy.py big.txt words.freq  saves a frequency table that is mapped instead of counted
 """
 import re
-from collections import Counter
+import sys
+import mmap
+import bisect
+import struct
+import itertools
+from collections import Counter, defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+FREQUENCY_MAGIC = b"TINYFREQ"
+FREQUENCY_HEADER = struct.Struct("<8sQQ")  # magic, number of words, bytes per word
 
 
 def words(text):
     return re.findall(r"\w+", text.lower())
 
 
-WORDS = Counter(words(open("big.txt").read()))
+class FrequencyTable:
+    """
+    word counts as a sorted fixed width bytes array and a count array, looked up by binary search
+
+    the arrays can wrap a mapped file, so forked workers read the same pages,
+    a table counted from text also keeps its word -> count dict, single words are looked up in it
+    """
+
+    def __init__(self, words, counts, buffer=None, word_counts=None):
+        self.words = words
+        self.counts = counts
+        self.total = int(counts.sum())
+        # keeps the mapping open as long as the arrays are in use
+        self.buffer = buffer
+        self.word_counts = word_counts
+
+    @classmethod
+    def from_counts(cls, counts):
+        pairs = sorted((word.encode(), count) for word, count in counts.items())
+        return cls(
+            np.array([word for word, count in pairs], dtype=bytes),
+            np.array([count for word, count in pairs], dtype=np.int64),
+            word_counts=dict(counts),
+        )
+
+    def get_counts(self, words):
+        "Counts of many `words` with one binary search, 0 for unknown words."
+        if not len(self.words):
+            return np.zeros(len(words), dtype=np.int64)
+        encoded = np.array([word.encode() for word in words], dtype=bytes)
+        positions = np.searchsorted(self.words, encoded).clip(max=len(self.words) - 1)
+        return np.where(self.words[positions] == encoded, self.counts[positions], 0)
+
+    def known(self, words):
+        "The subset of `words` in the table."
+        if self.word_counts is not None:
+            return {word for word in words if word in self.word_counts}
+        words = list(set(words))
+        if not words:
+            return set()
+        return {word for word, count in zip(words, self.get_counts(words).tolist()) if count}
+
+    def __getitem__(self, word):
+        if self.word_counts is not None:
+            return self.word_counts.get(word, 0)
+        # a binary search without building arrays for one word
+        encoded = word.encode()
+        position = bisect.bisect_left(self.words, encoded)
+        if position < len(self.words) and self.words[position] == encoded:
+            return int(self.counts[position])
+        return 0
+
+    def __contains__(self, word):
+        return self[word] > 0
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return (word.decode() for word in self.words.tolist())
+
+    def items(self):
+        return zip(self, self.counts.tolist())
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes + self.counts.nbytes
+
+
+def save_frequencies(path, table):
+    with open(path, "wb") as f:
+        f.write(FREQUENCY_HEADER.pack(FREQUENCY_MAGIC, len(table.words), table.words.dtype.itemsize))
+        f.write(table.words.tobytes())
+        f.write(b"\0" * (-f.tell() % 8))
+        f.write(table.counts.tobytes())
+
+
+def load_frequencies(path):
+    "A saved frequency table is mapped, any other file is read as text and counted."
+    with open(path, "rb") as f:
+        if f.read(len(FREQUENCY_MAGIC)) != FREQUENCY_MAGIC:
+            f.seek(0)
+            return FrequencyTable.from_counts(Counter(words(f.read().decode())))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, number_of_words, itemsize = FREQUENCY_HEADER.unpack_from(buffer)
+    offset = FREQUENCY_HEADER.size
+    word_array = np.frombuffer(buffer, dtype=f"S{itemsize}", count=number_of_words, offset=offset)
+    offset += number_of_words * itemsize
+    offset += -offset % 8
+    counts = np.frombuffer(buffer, dtype=np.int64, count=number_of_words, offset=offset)
+    return FrequencyTable(word_array, counts, buffer)
+
+
+class SpellCorrector:
+    """
+    Norvig's corrector, nothing is read until the first correction.
+
+    Call load() before forking workers: a mapped table is shared by the page cache,
+    the delete index is shared copy on write as long as gc.freeze() keeps the collector off its pages.
+    """
+
+    def __init__(self, path="big.txt", max_distance=2, cache_size=2 ** 16):
+        self.path = path
+        self.max_distance = max_distance
+        self.table = None
+        self.index = None
+        # token -> correction, least recently used first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        # worker processes of correct_stream, started once and kept for the next calls
+        self.executor = None
+        self.executor_workers = None
+
+    def __getstate__(self):
+        # a spawned worker loads its own copy, the mapping and the delete index don't pickle well
+        return {"path": self.path, "max_distance": self.max_distance, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def words(self):
+        if self.table is None:
+            self.table = load_frequencies(self.path)
+        return self.table
+
+    @property
+    def delete_index(self):
+        if self.index is None:
+            self.index = DeleteIndex(self.words, self.max_distance)
+        return self.index
+
+    def load(self, delete_index=True):
+        "Read everything now instead of on the first correction."
+        self.words
+        if delete_index:
+            self.delete_index
+        return self
+
+    def P(self, word):
+        "Probability of `word`."
+        return self.words[word] / self.words.total
+
+    def correction(self, word):
+        "Most probable spelling correction for word."
+        return max(self.candidates(word), key=self.P)
+
+    def candidates(self, word):
+        "Generate possible spelling corrections for word."
+        return self.known([word]) or self.known(edits1(word)) or self.known(edits2(word)) or [word]
+
+    def known(self, words):
+        "The subset of `words` that appear in the dictionary of WORDS."
+        return self.words.known(words)
+
+    def fast_correction(self, word):
+        "Most probable spelling correction for word, same as `correction` with a few dict lookups."
+        return max(self.fast_candidates(word), key=self.P)
+
+    def fast_candidates(self, word):
+        "Known words at the smallest edit distance from word, or [word]."
+        if word in self.words:
+            return [word]
+        by_distance = defaultdict(list)
+        for candidate, distance in self.delete_index.lookup(word).items():
+            # edits only insert and replace letters, any other character must come from word
+            if not Counter(re.sub("[a-z]", "", candidate)) - Counter(re.sub("[a-z]", "", word)):
+                by_distance[distance].append(candidate)
+        return by_distance[min(by_distance)] if by_distance else [word]
+
+    def correct_many(self, tokens, workers=None):
+        "Corrections of `tokens` in order, each distinct token is corrected once."
+        tokens = list(tokens)
+        return list(self.correct_stream(tokens, batch_size=max(len(tokens), 1), workers=workers))
+
+    def correct_stream(self, tokens, batch_size=1024, workers=None):
+        "Corrections of `tokens` as they come, a batch at a time, the misses of a batch can go to `workers` processes."
+        executor = self.get_executor(workers) if workers is not None and workers > 1 else None
+        tokens = iter(tokens)
+        while True:
+            batch = list(itertools.islice(tokens, batch_size))
+            if not batch:
+                return
+            corrections = self.get_corrections(dict.fromkeys(batch), executor, workers)
+            for token in batch:
+                yield corrections[token]
+
+    def get_executor(self, workers):
+        "The pool of `workers` processes, started on the first call that needs it."
+        if self.executor is None or self.executor_workers != workers:
+            self.close()
+            # forked workers start with this corrector, so load() first to share what is loaded
+            self.executor = ProcessPoolExecutor(workers, initializer=start_worker, initargs=(self,))
+            self.executor_workers = workers
+        return self.executor
+
+    def close(self):
+        "Stop the worker processes."
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = self.executor_workers = None
+
+    def get_corrections(self, tokens, executor=None, workers=None):
+        "{token: correction} for distinct `tokens`, from the cache when possible."
+        corrections = {}
+        misses = []
+        for token in tokens:
+            if token in self.cache:
+                self.cache.move_to_end(token)
+                corrections[token] = self.cache[token]
+            else:
+                misses.append(token)
 
+        if executor is not None and len(misses) > 1:
+            chunksize = -(-len(misses) // (workers * 4))
+            corrected = executor.map(correct_in_worker, misses, chunksize=chunksize)
+        else:
+            corrected = map(self.fast_correction, misses)
+        for token, correction in zip(misses, corrected):
+            corrections[token] = self.cache[token] = correction
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return corrections
 
-def P(word, N=sum(WORDS.values())):
+
+worker_corrector = None
+
+
+def start_worker(corrector):
+    global worker_corrector
+    worker_corrector = corrector
+
+
+def correct_in_worker(token):
+    return worker_corrector.fast_correction(token)
+
+
+corrector = SpellCorrector()
+
+
+def __getattr__(name):
+    # WORDS and DELETES used to be built at import, now they are read on first use
+    if name == "WORDS":
+        return corrector.words
+    if name == "DELETES":
+        return corrector.delete_index
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def P(word):
     "Probability of `word`."
-    return WORDS[word] / N
+    return corrector.P(word)
 
 
 def correction(word):
     "Most probable spelling correction for word."
-    return max(candidates(word), key=P)
+    return corrector.correction(word)
 
 
 def candidates(word):
     "Generate possible spelling corrections for word."
-    return known([word]) or known(edits1(word)) or known(edits2(word)) or [word]
+    return corrector.candidates(word)
 
 
 def known(words):
     "The subset of `words` that appear in the dictionary of WORDS."
-    return set(w for w in words if w in WORDS)
+    return corrector.known(words)
+
+
+def correct_many(tokens, workers=None):
+    "Corrections of `tokens` in order, each distinct token is corrected once."
+    return corrector.correct_many(tokens, workers)
+
+
+def correct_stream(tokens, batch_size=1024, workers=None):
+    "Corrections of `tokens` as they come."
+    return corrector.correct_stream(tokens, batch_size, workers)
 
 
 def edits1(word):
@@ -46,3 +317,149 @@ def edits1(word):
 def edits2(word):
     "All edits that are two edits away from `word`."
     return (e2 for e1 in edits1(word) for e2 in edits1(e1))
+
+
+def deletes(word, max_distance):
+    "All strings made by deleting up to `max_distance` characters from `word`, including `word`."
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+def edit_distance(a, b):
+    "Damerau-Levenshtein distance: fewest inserts, deletes, replaces and adjacent transposes from `a` to `b`."
+    infinity = len(a) + len(b)
+    last_row_of = {}
+    d = [[infinity] * (len(b) + 2)]
+    d += [[infinity] + list(range(len(b) + 1))]
+    for i in range(1, len(a) + 1):
+        d.append([infinity, i] + [0] * len(b))
+        last_match_column = 0
+        for j in range(1, len(b) + 1):
+            k = last_row_of.get(b[j - 1], 0)
+            l = last_match_column
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            if cost == 0:
+                last_match_column = j
+            d[i + 1][j + 1] = min(
+                d[i][j] + cost,
+                d[i + 1][j] + 1,
+                d[i][j + 1] + 1,
+                d[k][l] + (i - k - 1) + 1 + (j - l - 1),
+            )
+        last_row_of[a[i - 1]] = i
+    return d[len(a) + 1][len(b) + 1]
+
+
+class DeleteIndex:
+    """
+    Words keyed by every string made by deleting up to `max_distance` characters from them.
+
+    Two words within edit distance d share a string reachable with at most d deletes from each,
+    so a lookup only probes the deletes of the query instead of generating every edit of it.
+    """
+
+    def __init__(self, words, max_distance=2):
+        self.max_distance = max_distance
+        self.words = defaultdict(list)
+        for word in words:
+            for deleted in deletes(word, max_distance):
+                self.words[deleted].append(word)
+
+    def lookup(self, word, max_distance=None):
+        "Words within `max_distance` edits of `word`, with their distance."
+        if max_distance is None:
+            max_distance = self.max_distance
+        found = {}
+        for deleted in deletes(word, max_distance):
+            for candidate in self.words.get(deleted, ()):
+                if candidate not in found and abs(len(candidate) - len(word)) <= max_distance:
+                    found[candidate] = edit_distance(word, candidate)
+        return {candidate: distance for candidate, distance in found.items() if distance <= max_distance}
+
+    @property
+    def nbytes(self):
+        nbytes = sys.getsizeof(self.words)
+        for deleted, words in self.words.items():
+            nbytes += sys.getsizeof(deleted) + sys.getsizeof(words)
+        return nbytes
+
+
+class CompactDeleteIndex:
+    """
+    DeleteIndex packed into two numpy arrays, for vocabularies of millions of words.
+
+    The hashes of the deletes are sorted next to the id of the word each one came from,
+    a lookup binary searches the hashes of the deletes of the query, the edit distance weeds out hash collisions.
+    Words added later are merged into the sorted arrays, only their deletes are hashed.
+    """
+
+    def __init__(self, words, max_distance=1):
+        self.words = []
+        self.known = set()
+        self.max_distance = max_distance
+        self.hashes = np.zeros(0, dtype=np.int64)
+        self.word_ids = np.zeros(0, dtype=np.int64)
+        self.add(words)
+
+    def add(self, words):
+        "Index the `words` the index doesn't have yet."
+        hashes, word_ids = [], []
+        for word in words:
+            if word in self.known:
+                continue
+            self.known.add(word)
+            word_deletes = deletes(word, self.max_distance)
+            hashes.extend(map(hash, word_deletes))
+            word_ids.extend(itertools.repeat(len(self.words), len(word_deletes)))
+            self.words.append(word)
+        hashes = np.array(hashes, dtype=np.int64)
+        order = np.argsort(hashes, kind="stable")
+        hashes, word_ids = hashes[order], np.array(word_ids, dtype=np.int64)[order]
+        # after the equal hashes already there, so older words stay first
+        positions = np.searchsorted(self.hashes, hashes, side="right")
+        self.hashes = np.insert(self.hashes, positions, hashes)
+        self.word_ids = np.insert(self.word_ids, positions, word_ids)
+
+    def lookup(self, word, max_distance=None):
+        "Words within `max_distance` edits of `word`, with their distance."
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f"the index only finds words up to {self.max_distance} edits away")
+        query = np.array([hash(deleted) for deleted in deletes(word, max_distance)], dtype=np.int64)
+        starts = np.searchsorted(self.hashes, query, side="left")
+        ends = np.searchsorted(self.hashes, query, side="right")
+        word_ids = set()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            word_ids.update(self.word_ids[start:end].tolist())
+
+        found = {}
+        for word_id in word_ids:
+            candidate = self.words[word_id]
+            if abs(len(candidate) - len(word)) <= max_distance:
+                distance = edit_distance(word, candidate)
+                if distance <= max_distance:
+                    found[candidate] = distance
+        return found
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes + self.word_ids.nbytes + sys.getsizeof(self.words) + sys.getsizeof(self.known)
+
+
+def fast_correction(word):
+    "Most probable spelling correction for word, same as `correction` with a few dict lookups."
+    return corrector.fast_correction(word)
+
+
+def fast_candidates(word):
+    "Known words at the smallest edit distance from word, or [word]."
+    return corrector.fast_candidates(word)
+
+
+if __name__ == "__main__":
+    save_frequencies(sys.argv[2], load_frequencies(sys.argv[1]))
@@ -7,4 +7,213 @@ using sentences as nodes and tf-idf weighted cosine similarities as edges
 2. apply thresholding and teleportation
 3. run power method until the markov process settle down
 
+the similarity graph is never a dense S x S matrix:
+two sentences only have a similarity when they share a term,
+so every term pairs up the sentences in its posting list and the products of their weights add up per pair,
+a block of rows at a time, and only the pairs above the threshold are kept
+
+that is still S^2 for long documents, where most sentences share a common word,
+the approximate mode only scores the pairs that minhash signatures of the sentences bring together,
+see get_minhash_candidates
 """
+import re
+import numpy as np
+from tinysearch import Indexer, LinkGraph
+
+sentence_pattern = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in sentence_pattern.split(text) if sentence.strip()]
+
+
+def get_similarities(posting_arrays, weights, threshold, block_size=2 ** 22, dense=True):
+    """
+    (rows, columns, similarities) of the pairs of different sentences more similar than threshold, both ways
+
+    the dot products of the normalized sentence vectors, like the sparse product X * X.T,
+    computed for a block of rows at a time, dense blocks of rows x S similarities add up fastest
+    but cost S^2 over the whole document, otherwise only the pairs that share a term are sorted and added up
+    """
+    terms, urls, term_ids, doc_ids, _ = posting_arrays
+    number_of_sentences = len(urls)
+    # postings by term, to find the sentences a term pairs up with
+    by_term = np.argsort(term_ids, kind="stable")
+    term_docs, term_weights = doc_ids[by_term], weights[by_term]
+    dfs = np.bincount(term_ids, minlength=len(terms))
+    term_starts = np.cumsum(dfs) - dfs
+    # and by sentence, to walk over blocks of rows
+    by_doc = np.argsort(doc_ids, kind="stable")
+    doc_starts = np.searchsorted(doc_ids[by_doc], np.arange(number_of_sentences + 1))
+
+    rows, columns, similarities = [], [], []
+    block_rows = max(1, block_size // max(number_of_sentences, 1))
+    for first in range(0, number_of_sentences, block_rows):
+        last = min(first + block_rows, number_of_sentences)
+        postings = by_doc[doc_starts[first]:doc_starts[last]]
+        # every posting of the block pairs up with every posting of its term
+        repeats = dfs[term_ids[postings]]
+        offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        partners = np.repeat(term_starts[term_ids[postings]], repeats) + offsets
+        block_rows_of_pairs = np.repeat(doc_ids[postings] - first, repeats)
+        products = np.repeat(weights[postings], repeats) * term_weights[partners]
+        keys = block_rows_of_pairs * number_of_sentences + term_docs[partners]
+        if dense:
+            block = np.bincount(keys, weights=products, minlength=(last - first) * number_of_sentences)
+            pairs = np.flatnonzero(block > threshold)
+            block = block[pairs]
+        else:
+            order = np.argsort(keys, kind="stable")
+            keys, products = keys[order], products[order]
+            starts = np.flatnonzero(np.diff(keys, prepend=-1))
+            block = np.add.reduceat(products, starts) if len(keys) else products
+            pairs = keys[starts][block > threshold]
+            block = block[block > threshold]
+        block_rows_of_edges, block_columns = np.divmod(pairs, number_of_sentences)
+        # similarity of a sentence with itself is not an edge
+        keep = block_rows_of_edges + first != block_columns
+        rows.append(block_rows_of_edges[keep] + first)
+        columns.append(block_columns[keep])
+        similarities.append(block[keep])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(similarities)
+
+
+def ranges(starts, sizes):
+    """starts[0], starts[0] + 1, ..., starts[0] + sizes[0] - 1, starts[1], ... as one array"""
+    return np.repeat(starts, sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+
+def get_bucket_pairs(buckets, doc_ids, number_of_sentences, max_bucket):
+    """keys i * S + j of the pairs i < j of sentences in the same bucket, buckets over max_bucket are left out"""
+    order = np.argsort(buckets, kind="stable")
+    buckets, doc_ids = buckets[order], doc_ids[order]
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+    sizes = np.diff(np.append(starts, len(buckets)))
+    keep = (sizes > 1) & (sizes <= max_bucket)
+    starts, sizes = starts[keep], sizes[keep]
+    members = ranges(starts, sizes)
+    pair_counts = np.repeat(sizes, sizes)
+    firsts = doc_ids[np.repeat(members, pair_counts)]
+    seconds = doc_ids[ranges(np.repeat(starts, sizes), pair_counts)]
+    return firsts[firsts < seconds] * number_of_sentences + seconds[firsts < seconds]
+
+
+def get_minhash_candidates(posting_arrays, bands=64, rows=2, max_bucket=100, seed=0):
+    """
+    (first, second) sentences of the pairs that share a band of idf weighted minhash signatures, first < second
+
+    a minhash of a sentence is the term that wins a race, every term runs an exponential time over its idf,
+    two sentences get the same one with probability sum(idf of shared terms) / sum(idf of all their terms),
+    sentences without a shared term never do and rare shared terms count most, like in their tf-idf similarity,
+    a band is rows minhashes that must all be the same, more bands find more of the similar pairs
+    """
+    terms, urls, term_ids, doc_ids, _ = posting_arrays
+    number_of_sentences = len(urls)
+    by_doc = np.lexsort((term_ids, doc_ids))
+    doc_terms = term_ids[by_doc]
+    lengths = np.bincount(doc_ids, minlength=number_of_sentences)
+    sentences = np.flatnonzero(lengths)
+    if not len(sentences):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = (np.cumsum(lengths) - lengths)[sentences]
+    idfs = np.log((number_of_sentences + 1) / np.maximum(np.bincount(term_ids, minlength=len(terms)), 1))
+
+    rng = np.random.default_rng(seed)
+    pairs = []
+    for _ in range(bands):
+        buckets = np.zeros(len(sentences), dtype=np.int64)
+        for _ in range(rows):
+            times = (rng.exponential(size=len(terms)) / idfs)[doc_terms]
+            best_times = np.repeat(np.minimum.reduceat(times, starts), lengths[sentences])
+            winners = np.minimum.reduceat(np.where(times == best_times, doc_terms, len(terms)), starts)
+            # mixes the rows into one bucket key, it may wrap around
+            buckets = buckets * 1_000_003 + winners
+        # at most max_bucket pairs per sentence and band, the work grows with the number of sentences, not its square
+        pairs.append(np.unique(get_bucket_pairs(buckets, sentences, number_of_sentences, max_bucket)))
+    return np.divmod(np.unique(np.concatenate(pairs)), number_of_sentences)
+
+
+def get_pair_similarities(posting_arrays, weights, firsts, seconds):
+    """exact similarities of the pairs, by looking up the terms of the first sentence in the second"""
+    terms, urls, term_ids, doc_ids, _ = posting_arrays
+    by_doc = np.lexsort((term_ids, doc_ids))
+    doc_terms, doc_weights = term_ids[by_doc], weights[by_doc]
+    keys = doc_ids[by_doc] * len(terms) + doc_terms
+    lengths = np.bincount(doc_ids, minlength=len(urls))
+    repeats = lengths[firsts]
+    postings = ranges((np.cumsum(lengths) - lengths)[firsts], repeats)
+    wanted = np.repeat(seconds, repeats) * len(terms) + doc_terms[postings]
+    found = np.searchsorted(keys, wanted).clip(max=max(len(keys) - 1, 0))
+    shared = keys[found] == wanted if len(keys) else np.zeros(0, dtype=bool)
+    products = doc_weights[postings[shared]] * doc_weights[found[shared]]
+    return np.bincount(np.repeat(np.arange(len(firsts)), repeats)[shared], weights=products, minlength=len(firsts))
+
+
+def get_approximate_similarities(posting_arrays, weights, threshold, bands=64, rows=2, seed=0):
+    """like get_similarities, only for the minhash candidate pairs"""
+    firsts, seconds = get_minhash_candidates(posting_arrays, bands, rows, seed=seed)
+    similarities = get_pair_similarities(posting_arrays, weights, firsts, seconds)
+    similar = similarities > threshold
+    firsts, seconds, similarities = firsts[similar], seconds[similar], similarities[similar]
+    return np.concatenate((firsts, seconds)), np.concatenate((seconds, firsts)), np.concatenate((similarities,) * 2)
+
+
+def create_similarity_graph(number_of_sentences, rows, columns):
+    """
+    the thresholded graph as a markov chain: a sentence links to itself and to every sentence similar enough,
+    each link equally likely
+    """
+    # every sentence is similar to itself
+    self_loops = np.arange(number_of_sentences)
+    rows = np.concatenate((rows, self_loops))
+    columns = np.concatenate((columns, self_loops))
+    order = np.lexsort((columns, rows))
+    rows, columns = rows[order], columns[order]
+
+    degrees = np.bincount(rows, minlength=number_of_sentences)
+    indptr = np.zeros(number_of_sentences + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    return LinkGraph(indptr, columns, 1 / degrees[rows], degrees == 0)
+
+
+class LexRank:
+    def __init__(self, tokenizer, scorer, ranker, threshold=0.1, approximate=False, bands=64, rows=2):
+        # sentences are weighted like pages of the search index
+        self.indexer = Indexer(tokenizer, scorer)
+        # a tinysearch.PageRank, sentences are ranked like pages
+        self.ranker = ranker
+        self.threshold = threshold
+        # for book length documents, only pairs of sentences with a band of minhashes in common are scored,
+        # some similar pairs are missed but the work grows with bands times the length, not its square
+        self.approximate = approximate
+        self.bands = bands
+        self.rows = rows
+
+    def get_sentence_vectors(self, sentences):
+        """posting arrays of the sentences, urls are sentence numbers, and their weights from the scorer"""
+        posting_arrays = self.indexer.get_posting_arrays((i, sentence, []) for i, sentence in enumerate(sentences))
+        return posting_arrays, self.indexer.scorer.get_weights(posting_arrays, len(sentences))
+
+    def get_similarity_graph(self, sentences):
+        posting_arrays, weights = self.get_sentence_vectors(sentences)
+        if self.approximate:
+            rows, columns, similarities = get_approximate_similarities(posting_arrays, weights, self.threshold,
+                                                                       self.bands, self.rows)
+        else:
+            rows, columns, similarities = get_similarities(posting_arrays, weights, self.threshold)
+        # get_posting_arrays numbers the pages in order, doc ids are sentence numbers
+        return create_similarity_graph(len(sentences), rows, columns)
+
+    def rank_sentences(self, sentences):
+        if not sentences:
+            return []
+        return self.ranker.sparse_power_method(len(sentences), self.get_similarity_graph(sentences))
+
+    def summarize(self, text, number_of_sentences=3):
+        """the most central sentences, in the order they come in the text"""
+        sentences = split_sentences(text)
+        ranks = self.rank_sentences(sentences)
+        best = sorted(range(len(sentences)), key=lambda i: ranks[i], reverse=True)[:number_of_sentences]
+        return [sentences[i] for i in sorted(best)]
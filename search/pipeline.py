@@ -0,0 +1,65 @@
+"""
+crawl and index at the same time
+
+AsyncCrawler -> bounded queue -> SearchEngine.add_pages
+
+the crawler puts (url, content, links) of every page it fetches in a queue,
+the indexer takes them one at a time and adds them to the engine,
+while the event loop indexes a page the sockets of the pending fetches keep filling in the kernel,
+so time spent waiting for the network is time spent indexing,
+when indexing falls behind the queue fills up and crawls wait to put their page,
+holding their slot of the crawler's semaphore, so fetching slows down to the pace of indexing
+
+python pipeline.py https://example.com
+"""
+import os
+import sys
+import asyncio
+import logging
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web-spiders"))
+from crawler import AsyncCrawler
+
+
+async def index_pages(engine, pages):
+    """add the pages of the queue to the engine until a None, returns how many were added"""
+    number_of_pages = 0
+    while (page := await pages.get()) is not None:
+        engine.add_pages([page])
+        number_of_pages += 1
+        # get doesn't yield while pages are waiting, let the crawler go on after every page,
+        # a batch would hold back the fetches that finish meanwhile for the whole batch
+        await asyncio.sleep(0)
+    return number_of_pages
+
+
+async def crawl_and_index(engine, start_url, queue_size=256, max_concurrency=None):
+    """crawl the site of start_url into the engine, returns the number of pages indexed"""
+    pages = asyncio.Queue(maxsize=queue_size)
+    crawler = AsyncCrawler(max_concurrency, pages)
+    _, number_of_pages = await asyncio.gather(crawler.run(start_url), index_pages(engine, pages))
+    return number_of_pages
+
+
+def main():
+    from tinysearch import make_search_engine, search_forever
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("start_url")
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--fuzzy-distance", type=int, default=0, help="also match index terms this many edits away")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel("INFO")
+    engine = make_search_engine(args.fuzzy_distance)
+    number_of_pages = asyncio.run(
+        crawl_and_index(engine, args.start_url, args.queue_size, args.max_concurrency)
+    )
+    logging.info(f"indexed {number_of_pages} pages")
+    search_forever(engine)
+
+
+if __name__ == "__main__":
+    main()
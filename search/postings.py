@@ -0,0 +1,178 @@
+"""
+sorted posting list operations and positional postings for phrase and proximity queries
+
+every term keeps a sorted list of doc ids and, per doc, the gaps between its positions packed as varints
+"""
+import sys
+import math
+import bisect
+from collections import Counter
+import numpy as np
+from compact import encode_varints, decode_varints
+
+
+def intersect(a, b):
+    """
+    intersect two sorted lists, jumping over sqrt(n) sized blocks when a whole block is too small
+    """
+    skip_a, skip_b = int(math.sqrt(len(a))) or 1, int(math.sqrt(len(b))) or 1
+    i = j = 0
+    result = []
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            result.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            if i % skip_a == 0 and i + skip_a < len(a) and a[i + skip_a] <= b[j]:
+                i += skip_a
+            else:
+                i += 1
+        else:
+            if j % skip_b == 0 and j + skip_b < len(b) and b[j + skip_b] <= a[i]:
+                j += skip_b
+            else:
+                j += 1
+    return result
+
+
+def contains_sorted(a, b):
+    """mask of the items of a that are in b, by binary searching each of them in b"""
+    positions = np.searchsorted(b, a)
+    found = positions < len(b)
+    found[found] = b[positions[found]] == a[found]
+    return found
+
+
+def intersect_sorted(a, b):
+    """intersect two sorted numpy arrays, costs len(shorter) * log(len(longer))"""
+    if len(a) > len(b):
+        a, b = b, a
+    return a[contains_sorted(a, b)]
+
+
+def difference_sorted(a, b):
+    return a[~contains_sorted(a, b)]
+
+
+def union_sorted(a, b):
+    return np.union1d(a, b)
+
+
+def encode_positions(positions):
+    gaps = np.diff(positions, prepend=0)
+    buffer, lengths = encode_varints(gaps)
+    return buffer.tobytes()
+
+
+def decode_positions(data):
+    return np.cumsum(decode_varints(np.frombuffer(data, dtype=np.uint8))).tolist()
+
+
+def min_window(position_lists, counts=None):
+    """
+    smallest span of positions that holds counts[i] positions from list i, one from every list by default,
+    a term repeated in a phrase needs as many distinct positions as it has in the phrase
+    """
+    counts = counts or [1] * len(position_lists)
+    positions = sorted((position, i) for i, positions in enumerate(position_lists) for position in positions)
+    have = [0] * len(position_lists)
+    missing = sum(counts)
+    best = math.inf
+    left = 0
+    for right_position, i in positions:
+        have[i] += 1
+        if have[i] <= counts[i]:
+            missing -= 1
+        # shrink from the left while the window still holds enough of every list
+        while missing == 0:
+            left_position, j = positions[left]
+            best = min(best, right_position - left_position)
+            have[j] -= 1
+            if have[j] < counts[j]:
+                missing += 1
+            left += 1
+    return best
+
+
+class PositionalIndex:
+    def __init__(self):
+        self.postings = {}  # term -> ([doc id], [encoded positions])
+        self.doc_ids = {}  # url -> doc id
+        self.urls = {}  # doc id -> url
+        self.doc_terms = {}  # doc id -> terms
+        # ids only grow, so appending keeps every posting list sorted
+        self.next_doc_id = 0
+
+    def add(self, url, positions_by_term):
+        if url in self.doc_ids:
+            self.remove(url)
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+        self.doc_ids[url] = doc_id
+        self.urls[doc_id] = url
+        self.doc_terms[doc_id] = list(positions_by_term)
+        for term, positions in positions_by_term.items():
+            doc_ids, encoded_positions = self.postings.setdefault(term, ([], []))
+            doc_ids.append(doc_id)
+            encoded_positions.append(encode_positions(positions))
+
+    def remove(self, url):
+        doc_id = self.doc_ids.pop(url)
+        del self.urls[doc_id]
+        for term in self.doc_terms.pop(doc_id):
+            doc_ids, encoded_positions = self.postings[term]
+            i = bisect.bisect_left(doc_ids, doc_id)
+            del doc_ids[i]
+            del encoded_positions[i]
+            if not doc_ids:
+                del self.postings[term]
+
+    def get_positions(self, term, doc_id):
+        doc_ids, encoded_positions = self.postings[term]
+        return decode_positions(encoded_positions[bisect.bisect_left(doc_ids, doc_id)])
+
+    def match_phrase(self, phrase, slop=0):
+        """
+        urls of pages that hold the phrase, a list of (offset, term)
+
+        with slop 0 every term must sit at its offset from the first one,
+        otherwise the terms may come in any order, spread over at most slop more positions than the phrase
+        """
+        # how many phrase positions every term fills
+        terms = Counter(term for offset, term in phrase)
+        if not phrase or any(term not in self.postings for term in terms):
+            return set()
+        # start from the rarest term so the intersections stay small
+        doc_lists = sorted((self.postings[term][0] for term in terms), key=len)
+        doc_ids = doc_lists[0]
+        for other_doc_ids in doc_lists[1:]:
+            doc_ids = intersect(doc_ids, other_doc_ids)
+
+        span = max(offset for offset, term in phrase) - min(offset for offset, term in phrase)
+        urls = set()
+        for doc_id in doc_ids:
+            if slop == 0:
+                starts = None
+                for offset, term in phrase:
+                    shifted = {position - offset for position in self.get_positions(term, doc_id)}
+                    starts = shifted if starts is None else starts & shifted
+                is_match = bool(starts)
+            else:
+                position_lists = [self.get_positions(term, doc_id) for term in terms]
+                is_match = min_window(position_lists, list(terms.values())) <= span + slop
+            if is_match:
+                urls.add(self.urls[doc_id])
+        return urls
+
+    @property
+    def nbytes(self):
+        nbytes = sys.getsizeof(self.postings)
+        for term, (doc_ids, encoded_positions) in self.postings.items():
+            nbytes += sys.getsizeof(term) + sys.getsizeof(doc_ids) + sys.getsizeof(encoded_positions)
+            nbytes += sum(sys.getsizeof(data) for data in encoded_positions)
+        # a doc id is one int object shared by all of its postings
+        nbytes += sum(sys.getsizeof(doc_id) for doc_id in self.urls)
+        nbytes += sys.getsizeof(self.doc_ids) + sys.getsizeof(self.urls) + sys.getsizeof(self.doc_terms)
+        nbytes += sum(sys.getsizeof(terms) for terms in self.doc_terms.values())
+        return nbytes
@@ -0,0 +1,221 @@
+"""
+boolean queries
+
+query    : and_expr ((OR)? and_expr)*
+and_expr : not_expr (AND not_expr)*
+not_expr : NOT not_expr | atom
+atom     : WORD | "a phrase" | "a proximity query"~N | LPAREN query RPAREN
+
+operators are upper case, terms next to each other are OR-ed like in a plain query
+"""
+import re
+from collections import namedtuple
+import numpy as np
+from postings import intersect_sorted, difference_sorted, union_sorted
+
+Term = namedtuple("Term", ["term"])
+Phrase = namedtuple("Phrase", ["phrase", "slop"])
+And = namedtuple("And", ["children"])
+Or = namedtuple("Or", ["children"])
+Not = namedtuple("Not", ["child"])
+
+AND, OR, NOT = "AND", "OR", "NOT"
+LPAREN, RPAREN = "(", ")"
+PHRASE, WORD, EOF = "PHRASE", "WORD", "EOF"
+
+token_pattern = re.compile(r'(?P<PHRASE>"[^"]*"(?:~\d+)?)|(?P<PAREN>[()])|(?P<WORD>[^\s()"]+)')
+
+
+class QueryError(Exception):
+    pass
+
+
+def is_boolean(query):
+    """operators or balanced parentheses, a stray parenthesis is only punctuation of a plain query"""
+    tokens = re.findall(r'[^\s()"]+|[()]', query)
+    if any(token in (AND, OR, NOT) for token in tokens):
+        return True
+    depth = groups = 0
+    for token in tokens:
+        if token == LPAREN:
+            depth += 1
+            groups += 1
+        elif token == RPAREN:
+            depth -= 1
+            if depth < 0:
+                return False
+    return groups > 0 and depth == 0
+
+
+def combine(node_type, children):
+    """drop empty children, a single child stands for itself"""
+    children = tuple(child for child in children if child is not None)
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return node_type(children)
+
+
+def positive_terms(node):
+    """terms of the query that are not negated, these are the ones that score"""
+    if isinstance(node, Term):
+        return {node.term}
+    if isinstance(node, Phrase):
+        return {term for offset, term in node.phrase}
+    if isinstance(node, (And, Or)):
+        return set().union(*(positive_terms(child) for child in node.children))
+    return set()
+
+
+class QueryParser:
+    def __init__(self, tokenizer, vocabulary=None):
+        # the search engine tokenizer, so query words become index terms
+        self.tokenizer = tokenizer
+        # words of the index, only the others are spelling corrected
+        self.vocabulary = vocabulary
+        self.tokens = []
+        self.pos = 0
+
+    def lex(self, query):
+        tokens = []
+        for match in token_pattern.finditer(query):
+            if match.group("PHRASE"):
+                tokens.append((PHRASE, match.group("PHRASE")))
+            elif match.group("PAREN"):
+                tokens.append((match.group("PAREN"), match.group("PAREN")))
+            elif match.group("WORD") in (AND, OR, NOT):
+                tokens.append((match.group("WORD"), match.group("WORD")))
+            else:
+                tokens.append((WORD, match.group("WORD")))
+        tokens.append((EOF, None))
+        return tokens
+
+    @property
+    def current_token(self):
+        return self.tokens[self.pos]
+
+    def eat(self, token_type):
+        if self.current_token[0] != token_type:
+            raise QueryError(f"QueryError: expected {token_type}, got {self.current_token[1]!r}")
+        value = self.current_token[1]
+        self.pos += 1
+        return value
+
+    def parse(self, query):
+        """the query tree, None when nothing in the query can match a term"""
+        self.tokens = self.lex(query)
+        self.pos = 0
+        node = self.query()
+        if self.current_token[0] != EOF:
+            raise QueryError(f"QueryError: unexpected {self.current_token[1]!r}")
+        return node
+
+    def query(self):
+        children = [self.and_expr()]
+        while self.current_token[0] not in (EOF, RPAREN):
+            if self.current_token[0] == OR:
+                self.eat(OR)
+            children.append(self.and_expr())
+        return combine(Or, children)
+
+    def and_expr(self):
+        children = [self.not_expr()]
+        while self.current_token[0] == AND:
+            self.eat(AND)
+            children.append(self.not_expr())
+        return combine(And, children)
+
+    def not_expr(self):
+        if self.current_token[0] == NOT:
+            self.eat(NOT)
+            child = self.not_expr()
+            return None if child is None else Not(child)
+        return self.atom()
+
+    def atom(self):
+        token_type = self.current_token[0]
+        if token_type == LPAREN:
+            self.eat(LPAREN)
+            node = self.query()
+            self.eat(RPAREN)
+            return node
+        if token_type == PHRASE:
+            # '"a b"~3' splits into '"a b' and '~3'
+            text, _, slop = self.eat(PHRASE).rpartition('"')
+            phrase = tuple(self.tokenizer.position_generator(text[1:], correct=True, vocabulary=self.vocabulary))
+            return Phrase(phrase, int(slop[1:] or 0)) if phrase else None
+        word = self.eat(WORD)
+        # a word like "in't" can make more than one term
+        terms = self.tokenizer.token_generator(word, correct=True, vocabulary=self.vocabulary)
+        return combine(And, [Term(term) for term in terms])
+
+
+class DocIdIndex:
+    """sorted doc id arrays for the terms of any index, doc ids are positions in the sorted list of urls"""
+
+    def __init__(self, index, urls):
+        self.index = index
+        self.urls = sorted(urls)
+        self.doc_ids = {url: doc_id for doc_id, url in enumerate(self.urls)}
+        self.all_doc_ids = np.arange(len(self.urls))
+        self.doc_id_lists = {}
+
+    def get_doc_ids(self, urls):
+        return np.array(sorted(self.doc_ids[url] for url in urls), dtype=np.int64)
+
+    def __getitem__(self, term):
+        doc_ids = self.doc_id_lists.get(term)
+        if doc_ids is None:
+            urls = [url for url, weight in self.index[term]] if term in self.index else []
+            doc_ids = self.doc_id_lists[term] = self.get_doc_ids(urls)
+        return doc_ids
+
+
+class QueryEvaluator:
+    """doc ids matching a query tree"""
+
+    def __init__(self, doc_id_index, positional_index=None):
+        self.doc_id_index = doc_id_index
+        self.positional_index = positional_index
+
+    def visit(self, node):
+        return getattr(self, "visit_" + type(node).__name__)(node)
+
+    def visit_Term(self, node):
+        return self.doc_id_index[node.term]
+
+    def visit_Phrase(self, node):
+        if self.positional_index is None:
+            # without positions a phrase only needs all of its terms
+            return self.visit(combine(And, [Term(term) for offset, term in node.phrase]))
+        return self.doc_id_index.get_doc_ids(self.positional_index.match_phrase(node.phrase, node.slop))
+
+    def visit_And(self, node):
+        included = [self.visit(child) for child in node.children if not isinstance(child, Not)]
+        excluded = [self.visit(child.child) for child in node.children if isinstance(child, Not)]
+        if not included:
+            included = [self.doc_id_index.all_doc_ids]
+        # shortest lists first, each intersection only probes the ids that survived so far
+        included.sort(key=len)
+        doc_ids = included[0]
+        for other_doc_ids in included[1:]:
+            if not len(doc_ids):
+                break
+            doc_ids = intersect_sorted(doc_ids, other_doc_ids)
+        for other_doc_ids in excluded:
+            doc_ids = difference_sorted(doc_ids, other_doc_ids)
+        return doc_ids
+
+    def visit_Or(self, node):
+        doc_ids = self.visit(node.children[0])
+        for child in node.children[1:]:
+            doc_ids = union_sorted(doc_ids, self.visit(child))
+        return doc_ids
+
+    def visit_Not(self, node):
+        return difference_sorted(self.doc_id_index.all_doc_ids, self.visit(node.child))
+
+    def evaluate(self, node):
+        """urls of the matching pages"""
+        return {self.doc_id_index.urls[doc_id] for doc_id in self.visit(node).tolist()}
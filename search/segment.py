@@ -0,0 +1,136 @@
+"""
+on-disk segment for a tinysearch index
+
+one file: a header, a table of sections, then every array of a CompactIndex plus the page rank vector
+opening a segment maps the file and wraps the sections with numpy, nothing is parsed or copied,
+so startup is instant and worker processes share the same pages through the page cache
+
+header: magic, version, number of pages, number of sections, name of the scorer that weighted the postings
+section: name, numpy dtype, offset in bytes from the start of the file, number of items
+"""
+import mmap
+import struct
+import numpy as np
+from compact import CompactIndex, StringTable
+
+MAGIC = b"TINYSEG\0"
+VERSION = 2
+HEADER = struct.Struct("<8sIQI16s")
+SECTION = struct.Struct("<16s8sQQ")
+ALIGNMENT = 8
+
+
+class SegmentError(Exception):
+    pass
+
+
+class PageRankTable:
+    """
+    page rank vector aligned with the doc table of the index, behaves like the page_rank dict
+
+    the urls are decoded into a dict on the first lookup, searches look up every page they score
+    """
+
+    def __init__(self, urls, ranks):
+        self.urls = urls
+        self.ranks = ranks
+        self.ranks_by_url = None
+
+    def get_ranks_by_url(self):
+        if self.ranks_by_url is None:
+            self.ranks_by_url = dict(zip(self.urls, self.ranks.tolist()))
+        return self.ranks_by_url
+
+    def get(self, url, default=None):
+        return self.get_ranks_by_url().get(url, default)
+
+    def __getitem__(self, url):
+        return self.get_ranks_by_url()[url]
+
+    def __contains__(self, url):
+        return url in self.get_ranks_by_url()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __iter__(self):
+        return iter(self.get_ranks_by_url())
+
+    def values(self):
+        return self.ranks.tolist()
+
+    def items(self):
+        return self.get_ranks_by_url().items()
+
+
+class Segment:
+    def __init__(self, index, page_rank, number_of_pages, scorer, buffer=None):
+        self.index = index
+        self.page_rank = page_rank
+        self.number_of_pages = number_of_pages
+        # weights of one scorer don't mix with the query weights of another
+        self.scorer = scorer
+        # keeps the mapping open as long as the arrays are in use
+        self.buffer = buffer
+
+
+def save_segment(path, index, page_rank, number_of_pages, scorer):
+    urls = sorted(page_rank)
+    if not isinstance(index, CompactIndex) or list(index.urls) != urls:
+        index = CompactIndex.from_index({term: index[term] for term in index}, urls=urls)
+    ranks = np.array([page_rank[url] for url in urls], dtype=np.float64)
+
+    sections = {
+        "term_data": index.terms.data,
+        "term_offsets": index.terms.offsets,
+        "url_data": index.urls.data,
+        "url_offsets": index.urls.offsets,
+        "posting_offsets": index.posting_offsets,
+        "byte_offsets": index.byte_offsets,
+        "gaps": index.gaps,
+        "weights": index.weights,
+        "page_ranks": ranks,
+    }
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, array in sections.items():
+        offset += -offset % ALIGNMENT
+        table.append(SECTION.pack(name.encode(), array.dtype.str.encode(), offset, len(array)))
+        offset += array.nbytes
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, number_of_pages, len(sections), scorer.encode()))
+        f.writelines(table)
+        for array in sections.values():
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def open_segment(path):
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, number_of_pages, number_of_sections, scorer = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise SegmentError(f"{path} is not a tinysearch segment")
+    if version != VERSION:
+        raise SegmentError(f"{path} has segment version {version}, expected {VERSION}")
+
+    sections = {}
+    for i in range(number_of_sections):
+        name, dtype, offset, count = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        sections[name.rstrip(b"\0").decode()] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+    urls = StringTable(sections["url_data"], sections["url_offsets"])
+    index = CompactIndex(
+        StringTable(sections["term_data"], sections["term_offsets"]),
+        urls,
+        sections["posting_offsets"],
+        sections["byte_offsets"],
+        sections["gaps"],
+        sections["weights"],
+    )
+    page_rank = PageRankTable(urls, sections["page_ranks"])
+    return Segment(index, page_rank, number_of_pages, scorer.rstrip(b"\0").decode(), buffer)
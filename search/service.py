@@ -0,0 +1,172 @@
+"""
+tinysearch over http
+
+GET /search?q=romeo&k=10 -> {"query": "romeo", "k": 10, "results": [{"url": "a.com", "score": 0.1}]}
+
+a tiny HTTP/1.1 server on asyncio streams, connections are kept alive,
+one SearchEngine answers every query until swap replaces it,
+a query holds on to the engine it started with so a swap never blocks or breaks it,
+queries run on a thread of their own so a slow one doesn't hold up reading and answering other requests
+
+python service.py --port 8000                  serves the sample pages
+python service.py --segment index.seg          serves a saved segment
+"""
+import json
+import asyncio
+import logging
+import argparse
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from query import QueryError
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SearchService:
+    def __init__(self, engine):
+        self.engine = engine
+        self.swaps = 0
+        self.server = None
+        # one thread, an engine builds its caches on the first queries and isn't safe to search from two at once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+
+    def swap(self, engine):
+        """serve a new engine, queries already running finish on the old one"""
+        # a single reference assignment, no reader ever sees a half built engine
+        self.engine = engine
+        self.swaps += 1
+
+    async def rebuild(self, make_engine):
+        """build an engine in a thread while queries go on, then swap it in"""
+        engine = await asyncio.get_running_loop().run_in_executor(None, make_engine)
+        self.swap(engine)
+        return engine
+
+    def parse(self, target):
+        """query and k of a search request"""
+        url = urllib.parse.urlsplit(target)
+        if url.path != "/search":
+            raise HttpError(404, f"no such path {url.path}")
+        params = urllib.parse.parse_qs(url.query)
+        query = params.get("q", [""])[0]
+        if not query:
+            raise HttpError(400, "q is required")
+        k = params.get("k", [None])[0]
+        try:
+            k = None if k is None else int(k)
+        except ValueError:
+            raise HttpError(400, f"k must be a number, got {k!r}")
+        if k is not None and k < 1:
+            raise HttpError(400, f"k must be positive, got {k}")
+        return query, k
+
+    def search(self, query, k):
+        engine = self.engine
+        try:
+            results = engine.search(query, k=k)
+        except QueryError as e:
+            raise HttpError(400, str(e))
+        return {"query": query, "k": k, "results": [{"url": url, "score": float(score)} for url, score in results]}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                method, target, version = request_line.decode("latin-1").split(maxsplit=2)
+                try:
+                    if method != "GET":
+                        raise HttpError(405, f"{method} is not allowed")
+                    query, k = self.parse(target)
+                    body = await asyncio.get_running_loop().run_in_executor(self.executor, self.search, query, k)
+                    status = 200
+                except HttpError as e:
+                    status, body = e.status, {"error": str(e)}
+                except Exception as e:
+                    # a bug in the engine still gets an answer, the connection stays usable
+                    logging.exception(f"failed to answer {target}")
+                    status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+
+                keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                payload = json.dumps(body).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError) as e:
+            logging.debug(f"dropped connection {e!r}")
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host="127.0.0.1", port=8000):
+        await self.start(host, port)
+        logging.info(f"serving on {host}:{self.port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+
+def make_sample_engine():
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine, QueryCache
+
+    scorer = Scorer()
+    engine = SearchEngine(Indexer(Tokenizer({"the", "a", "an", "is", "this", "to"}), scorer), PageRank(scorer),
+                          QueryCache())
+    engine.start([
+        ("a.com", "oh romeo wherefore art thou?", ["b.com", "d.com", "e.com"]),
+        ("b.com", "These Violent Delights Have Violent Ends", ["d.com", "c.com"]),
+        ("c.com", "The fool doth think he is wise, but the wise man knows himself to be a fool.", ["d.com", "b.com"]),
+        ("d.com", "Love all, trust a few, do wrong to none.", ["a.com", "b.com"]),
+        ("e.com", "Though this be madness, yet there is method in't.", ["c.com", "a.com"]),
+    ])
+    return engine
+
+
+def main():
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine, QueryCache
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--segment", help="a segment saved by SearchEngine.save")
+    args = parser.parse_args()
+
+    if args.segment:
+        scorer = Scorer()
+        engine = SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer), QueryCache())
+        engine.open(args.segment)
+    else:
+        engine = make_sample_engine()
+    logging.getLogger().setLevel("INFO")
+    asyncio.run(SearchService(engine).serve_forever(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+power iteration for the stationary vector of a markov chain, shared by page rank and lexrank
+
+x <- step(x) until the L1 residual |x_k+1 - x_k| drops under the tolerance,
+every step is scaled back to a probability vector so links that lead nowhere don't drain the ranks
+
+quadratic extrapolation (Kamvar et al. 2003) every few steps cancels the second and third eigenvectors,
+which decay slowest when the teleport rate is low
+"""
+import time
+import logging
+from collections import namedtuple, deque
+import numpy as np
+
+# what the last solve took, iterations counts the steps, not the extrapolations
+SolverStats = namedtuple("SolverStats", ["iterations", "residual", "seconds", "converged"])
+
+
+def quadratic_extrapolation(x0, x1, x2, x3):
+    """estimate of the limit from four successive iterates"""
+    y1, y2, y3 = x1 - x0, x2 - x0, x3 - x0
+    # least squares fit of y3 = -(g1 * y1 + g2 * y2)
+    (g1, g2), *_ = np.linalg.lstsq(np.column_stack((y1, y2)), -y3, rcond=None)
+    g3 = 1
+    return (g1 + g2 + g3) * x1 + (g2 + g3) * x2 + g3 * x3
+
+
+class PowerIteration:
+    def __init__(self, tolerance=1e-10, max_iterations=10000, extrapolate_every=0):
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        # 0 turns extrapolation off
+        self.extrapolate_every = extrapolate_every
+        self.stats = None
+
+    def solve(self, step, initial):
+        """fixed point of step, starting from initial, which can be the answer to a similar problem"""
+        start = time.perf_counter()
+        ranks = np.asarray(initial, dtype=np.float64)
+        ranks = ranks / ranks.sum()
+        history = deque([ranks], maxlen=4)
+        residual = np.inf
+        iterations = 0
+        while iterations < self.max_iterations and residual >= self.tolerance:
+            new_ranks = step(ranks)
+            new_ranks = new_ranks / new_ranks.sum()
+            residual = np.abs(new_ranks - ranks).sum()
+            ranks = new_ranks
+            iterations += 1
+            history.append(ranks)
+            if self.extrapolate_every and iterations % self.extrapolate_every == 0 and len(history) == 4:
+                extrapolated = quadratic_extrapolation(*history)
+                # a poor fit can push a few ranks below zero, keep the plain step then
+                if (extrapolated > 0).all():
+                    ranks = extrapolated / extrapolated.sum()
+                    history.clear()
+                    history.append(ranks)
+
+        self.stats = SolverStats(iterations, residual, time.perf_counter() - start, residual < self.tolerance)
+        logging.debug(f"power iteration {self.stats}")
+        return ranks
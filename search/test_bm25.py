@@ -0,0 +1,103 @@
+""" tests """
+import math
+from collections import Counter
+import pytest
+from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+from bm25 import BM25, FieldIndex
+
+pages = [
+    ("a.com", "oh romeo wherefore art thou romeo?", ["b.com", "d.com", "e.com"]),
+    ("b.com", "These Violent Delights Have Violent Ends", ["d.com", "c.com"]),
+    ("c.com", "The fool doth think he is wise, but the wise man knows himself to be a fool.", ["d.com", "b.com"]),
+    ("d.com", "Love all, trust a few, do wrong to none.", ["a.com", "b.com"]),
+    ("e.com", "Though this be madness, yet there is method in't.", ["c.com", "a.com"]),
+    ("f.com", "a fool and his money are soon parted", []),
+]
+
+
+def make_engine(scorer, **indexer_options):
+    tokenizer = Tokenizer({"the", "a", "an", "is", "this", "to"})
+    return SearchEngine(Indexer(tokenizer, scorer, **indexer_options), PageRank(scorer))
+
+
+def reference_bm25(term, url, k1=1.2, b=0.75):
+    """the textbook formula, one page at a time"""
+    tokenizer = Tokenizer({"the", "a", "an", "is", "this", "to"})
+    counts = {url: Counter(tokenizer.token_generator(content)) for url, content, links in pages}
+    average_length = sum(sum(page_counts.values()) for page_counts in counts.values()) / len(pages)
+    df = sum(term in page_counts for page_counts in counts.values())
+    idf = math.log(1 + (len(pages) - df + 0.5) / (df + 0.5))
+    tf, length = counts[url][term], sum(counts[url].values())
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+
+
+def test_bm25_weights():
+    field_engine = make_engine(BM25())
+    field_engine.start(pages)
+    assert isinstance(field_engine.index, FieldIndex)
+    compact_engine = make_engine(BM25(), compact=True)
+    compact_engine.start(pages)
+    incremental_engine = make_engine(BM25())
+    incremental_engine.add_pages(pages)
+
+    assert sorted(field_engine.index) == sorted(compact_engine.index) == sorted(incremental_engine.index)
+    for term in field_engine.index:
+        expected = {url: reference_bm25(term, url) for url, weight in field_engine.index[term]}
+        assert dict(field_engine.index[term]) == pytest.approx(expected)
+        assert dict(compact_engine.index[term]) == pytest.approx(expected, rel=1e-6)
+        assert dict(incremental_engine.index[term]) == pytest.approx(expected)
+
+    # the weights of the dict pipeline come from the scorer too
+    indexer = field_engine.indexer
+    weighted_index = indexer.get_weighted_index(indexer.get_count_index(pages), len(pages))
+    for term, docs in weighted_index.items():
+        assert dict(docs) == pytest.approx({url: reference_bm25(term, url) for url, weight in docs})
+
+    for query in ["romeo", "wise fool", "violent love madness", "nothing"]:
+        results = field_engine.search(query)
+        assert dict(incremental_engine.search(query)) == pytest.approx(dict(results))
+        assert dict(field_engine.search(query, k=2)) == pytest.approx(dict(results[:2]))
+
+
+def test_fields():
+    engine = make_engine(BM25())
+    engine.start(pages)
+    weights = dict(engine.index["fool"])
+    assert weights["c.com"] > weights["f.com"]
+    content_tfs = dict(zip(*(array.tolist() for array in engine.index.get_tfs("fool"))))
+
+    # a title field that only f.com has the term in, weighted up
+    engine.add_field("title", [("f.com", "the fool"), ("c.com", "as you like it"), ("z.com", "fool")], weight=3)
+    weights = dict(engine.index["fool"])
+    assert weights["f.com"] > weights["c.com"]
+    assert "z.com" not in weights
+    assert "like" in engine.index
+    assert "f.com" in dict(engine.search("fool"))
+
+    # frequencies add up over the fields before they saturate, titles are 2.5 terms long on average
+    tfs = dict(zip(*(array.tolist() for array in engine.index.get_tfs("fool"))))
+    f_doc_id = engine.index.doc_ids["f.com"]
+    assert tfs[f_doc_id] == pytest.approx(content_tfs[f_doc_id] + 3 / (1 - 0.75 + 0.75 * 1 / 2.5))
+
+    # scores add up from the arrays of the postings like from the (url, weight) pairs
+    query_weights = {"fool": 1.0, "like": 1.0, "wise": 1.0}
+    expected = Counter()
+    for term in query_weights:
+        for url, weight in engine.index[term]:
+            expected[url] += weight
+    assert dict(engine.ranker.get_array_scores(engine.index, query_weights)) == pytest.approx(expected)
+    assert len(engine.index) == len(set(engine.index))
+
+    # a field of the same name replaces the old one
+    engine.add_field("title", [("c.com", "the fool")])
+    weights = dict(engine.index["fool"])
+    assert weights["c.com"] > weights["f.com"]
+    assert "like" not in engine.index
+    assert len(engine.index) == len(set(engine.index))
+
+
+def test_fields_need_bm25():
+    engine = make_engine(Scorer())
+    engine.start(pages)
+    with pytest.raises(ValueError):
+        engine.add_field("title", [("a.com", "romeo and juliet")])
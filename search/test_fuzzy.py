@@ -0,0 +1,95 @@
+""" tests """
+import pytest
+import fuzzy
+from fuzzy import SpellCorrector, FrequencyTable, save_frequencies, load_frequencies
+
+text = """
+the quick brown fox jumps over the lazy dog, the dog sleeps
+spelling correction is the art of guessing the word somebody meant to write
+a fox is quick and a dog is lazy, correction of spelling takes a dictionary
+"""
+
+
+@pytest.fixture
+def dictionary(tmp_path):
+    path = tmp_path / "words.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_import_reads_nothing():
+    assert fuzzy.corrector.table is None
+    assert fuzzy.corrector.index is None
+
+
+def test_frequency_table(dictionary, tmp_path):
+    table = load_frequencies(dictionary)
+    path = str(tmp_path / "words.freq")
+    save_frequencies(path, table)
+    mapped = load_frequencies(path)
+
+    assert dict(mapped.items()) == dict(table.items())
+    assert mapped["the"] == 5
+    assert mapped["missing"] == 0
+    assert "fox" in mapped and "cat" not in mapped
+    assert mapped.known(["fox", "cat", "dog"]) == table.known(["fox", "cat", "dog"]) == {"fox", "dog"}
+    assert table["the"] == 5 and table["missing"] == 0 and mapped["a"] == table["a"]
+    assert mapped.total == sum(fuzzy.words(text).count(word) for word in set(fuzzy.words(text)))
+    assert FrequencyTable.from_counts({}).known(["a"]) == set()
+
+
+def test_spell_corrector(dictionary):
+    corrector = SpellCorrector(dictionary)
+    assert corrector.table is None
+
+    misspellings = {"speling": "spelling", "corection": "correction", "teh": "the", "foxx": "fox", "dgo": "dog",
+                    "lazzy": "lazy", "quick": "quick", "zzzzzz": "zzzzzz"}
+    for word, expected in misspellings.items():
+        assert corrector.correction(word) == expected
+        assert corrector.fast_correction(word) == expected
+    assert corrector.delete_index.lookup("dgo", max_distance=1) == {"dog": 1}
+
+
+def test_correct_many(dictionary):
+    corrector = SpellCorrector(dictionary, cache_size=3)
+    tokens = ["teh", "dgo", "teh", "foxx", "fox", "teh", "lazzy"]
+    expected = ["the", "dog", "the", "fox", "fox", "the", "lazy"]
+
+    assert corrector.correct_many(tokens) == expected
+    assert list(corrector.cache) == ["foxx", "fox", "lazzy"]
+    assert list(corrector.correct_stream(iter(tokens), batch_size=2)) == expected
+    assert len(corrector.cache) == 3
+    assert corrector.correct_many(tokens, workers=2) == expected
+    # the workers are started once
+    executor = corrector.executor
+    corrector.cache.clear()
+    assert corrector.correct_many(tokens, workers=2) == expected
+    assert corrector.executor is executor
+    corrector.close()
+    assert corrector.executor is None
+    assert corrector.correct_many([]) == []
+
+
+def test_did_you_mean(dictionary):
+    from tinysearch import Tokenizer
+
+    tokenizer = Tokenizer({"the", "a"}, corrector=SpellCorrector(dictionary))
+    assert list(tokenizer.token_generator("Teh quik fox")) == ["teh", "quik", "fox"]
+    assert list(tokenizer.token_generator("Teh quik fox", correct=True)) == ["quick", "fox"]
+
+
+def test_only_missing_words_are_corrected(dictionary):
+    from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+
+    scorer = Scorer()
+    tokenizer = Tokenizer({"the", "a"}, corrector=SpellCorrector(dictionary))
+    engine = SearchEngine(Indexer(tokenizer, scorer, positions=True), PageRank(scorer))
+    engine.start([("a.com", "the quick fox", ["b.com"]), ("b.com", "foxes zorblat", ["c.com"]),
+                  ("c.com", "lazy dog", ["a.com"])])
+    # foxes is one edit from fox, but the index has it
+    assert [url for url, score in engine.search("foxes")] == ["b.com"]
+    assert [url for url, score in engine.search("quik")] == ["a.com"]
+    # the same inside quotes and in boolean queries
+    assert [url for url, score in engine.search('"quik fox"')] == ["a.com"]
+    assert [url for url, score in engine.search('"foxes zorblat"')] == ["b.com"]
+    assert [url for url, score in engine.search("foxes AND NOT quik")] == ["b.com"]
@@ -0,0 +1,88 @@
+""" tests """
+import numpy as np
+import pytest
+from tinysearch import Tokenizer, Scorer, PageRank
+from lexrank import LexRank, split_sentences
+
+text = """
+The fool doth think he is wise, but the wise man knows himself to be a fool. Love all, trust a few, do wrong to none.
+A wise man loves the few and the fool loves all! Though this be madness, yet there is method in't.
+Is a fool wise? These violent delights have violent ends. The wise man and the fool both love madness.
+"""
+
+
+def make_lexrank(threshold=0.1):
+    scorer = Scorer()
+    return LexRank(Tokenizer({"the", "a", "an", "is", "this", "to"}), scorer, PageRank(scorer), threshold)
+
+
+def dense_lexrank(lexrank, sentences):
+    """reference: the whole S x S similarity matrix"""
+    posting_arrays, weights = lexrank.get_sentence_vectors(sentences)
+    vectors = np.zeros((len(sentences), len(posting_arrays.terms)))
+    vectors[np.array(posting_arrays.urls)[posting_arrays.doc_ids], posting_arrays.term_ids] = weights
+    adjacency = (vectors @ vectors.T > lexrank.threshold).astype(float)
+    np.fill_diagonal(adjacency, 1)
+    transitions = adjacency / adjacency.sum(axis=1, keepdims=True)
+    ranks = np.full(len(sentences), 1 / len(sentences))
+    for _ in range(1000):
+        ranks = (1 - lexrank.ranker.teleport_rate) * ranks @ transitions + lexrank.ranker.teleport_rate / len(sentences)
+    return ranks
+
+
+def test_split_sentences():
+    assert split_sentences("One. Two!  Three? four") == ["One.", "Two!", "Three?", "four"]
+    assert split_sentences("  ") == []
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.1, 0.3])
+def test_lexrank(threshold):
+    lexrank = make_lexrank(threshold)
+    sentences = split_sentences(text)
+    assert lexrank.rank_sentences(sentences) == pytest.approx(dense_lexrank(lexrank, sentences).tolist(), abs=1e-4)
+
+    summary = lexrank.summarize(text, 2)
+    assert len(summary) == 2
+    assert summary == [sentence for sentence in sentences if sentence in summary]
+    assert lexrank.summarize("", 2) == []
+
+
+def test_similarity_blocks():
+    from lexrank import get_similarities
+
+    lexrank = make_lexrank()
+    posting_arrays, weights = lexrank.get_sentence_vectors(split_sentences(text))
+    rows, columns, similarities = get_similarities(posting_arrays, weights, 0.1)
+    for block_size in (1, 10, 50):
+        for dense in (True, False):
+            blocks = get_similarities(posting_arrays, weights, 0.1, block_size, dense)
+            assert [array.tolist() for array in blocks[:2]] == [rows.tolist(), columns.tolist()]
+            assert blocks[2].tolist() == pytest.approx(similarities.tolist())
+    assert (similarities > 0.1).all()
+    assert not (rows == columns).any()
+
+
+def test_approximate_lexrank():
+    from lexrank import get_minhash_candidates, get_pair_similarities, get_similarities
+
+    sentences = split_sentences(text)
+    exact = make_lexrank()
+    posting_arrays, weights = exact.get_sentence_vectors(sentences)
+    rows, columns, similarities = get_similarities(posting_arrays, weights, 0.0)
+    expected = dict(zip(zip(rows.tolist(), columns.tolist()), similarities.tolist()))
+
+    firsts, seconds = get_minhash_candidates(posting_arrays, bands=32, rows=1)
+    assert (firsts < seconds).all()
+    # only sentences with a term in common can share a minhash
+    assert set(zip(firsts.tolist(), seconds.tolist())) <= set(expected)
+    # and candidates get their exact similarity
+    pair_similarities = get_pair_similarities(posting_arrays, weights, firsts, seconds)
+    pairs = zip(firsts.tolist(), seconds.tolist())
+    assert pair_similarities.tolist() == pytest.approx([expected[pair] for pair in pairs])
+
+    # enough bands of one minhash find every similar pair of a short text
+    approximate = make_lexrank()
+    approximate.approximate, approximate.bands, approximate.rows = True, 256, 1
+    assert approximate.rank_sentences(sentences) == pytest.approx(exact.rank_sentences(sentences))
+    assert len(approximate.summarize(text, 2)) == 2
+    assert approximate.summarize("", 2) == []
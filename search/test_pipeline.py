@@ -0,0 +1,56 @@
+""" tests """
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("bs4")
+from tinysearch import make_search_engine
+from pipeline import crawl_and_index
+
+site = {
+    "/": ("oh romeo wherefore art thou?", ["/b", "/d", "/e"]),
+    "/b": ("These Violent Delights Have Violent Ends", ["/d", "/c", "https://elsewhere.com/"]),
+    "/c": ("The fool doth think he is wise, but the wise man knows himself to be a fool.", ["/d", "/b#top"]),
+    "/d": ("Love all, trust a few, do wrong to none.", ["/", "/b"]),
+    "/e": ("Though this be madness, yet there is method in't.", ["/c", "/"]),
+}
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in site:
+            self.send_error(404)
+            return
+        content, links = site[self.path]
+        anchors = "".join(f'<a href="{link}">{link}</a>' for link in links)
+        body = f"<html><body><p>{content}</p>{anchors}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def start_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("queue_size", [1, 256])
+def test_crawl_and_index(start_url, queue_size):
+    engine = make_search_engine()
+    number_of_pages = asyncio.run(crawl_and_index(engine, start_url, queue_size))
+    assert number_of_pages == engine.number_of_pages == len(site)
+    assert [url for url, score in engine.search("wise fool")] == [start_url + "c"]
+    # links are absolute, without fragments, and leaving the site is fine
+    assert engine.links[start_url + "c"] == [start_url + "b", start_url + "d"]
+    assert "https://elsewhere.com/" in engine.links[start_url + "b"]
+    assert len(engine.search("romeo madness")) == 2
@@ -0,0 +1,136 @@
+""" tests """
+import json
+import asyncio
+import threading
+from tinysearch import Tokenizer, Scorer, Indexer, PageRank, SearchEngine
+from service import SearchService, make_sample_engine
+
+
+async def get(port, target, connection="keep-alive"):
+    """status and json body of one request on a new connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: {connection}\r\n\r\n".encode())
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) != b"\r\n":
+        name, _, value = line.decode().partition(":")
+        headers[name.lower()] = value.strip()
+    body = json.loads(await reader.readexactly(int(headers["content-length"])))
+    writer.close()
+    return status, body
+
+
+def run(service, *targets):
+    async def main():
+        await service.start(port=0)
+        async with service.server:
+            return [await get(service.port, target) for target in targets]
+
+    return asyncio.run(main())
+
+
+def test_search():
+    engine = make_sample_engine()
+    service = SearchService(engine)
+    (status, body), (top_status, top_body) = run(service, "/search?q=wise+fool", "/search?q=wise%20fool&k=1")
+    assert status == 200
+    assert [(result["url"], result["score"]) for result in body["results"]] == engine.search("wise fool")
+    assert top_status == 200
+    assert top_body["k"] == 1
+    assert [result["url"] for result in top_body["results"]] == ["c.com"]
+
+
+def test_bad_requests():
+    responses = run(SearchService(make_sample_engine()), "/search", "/search?q=fool&k=ten", "/search?q=fool&k=0",
+                    "/index")
+    assert [status for status, body in responses] == [400, 400, 400, 404]
+    assert all("error" in body for status, body in responses)
+    # a stray parenthesis is not a boolean query
+    (status, body), = run(SearchService(make_sample_engine()), "/search?q=(fool")
+    assert status == 200 and body["results"]
+
+
+def test_engine_errors():
+    class BrokenEngine:
+        def search(self, query, k=None):
+            raise RuntimeError("broken")
+
+    (status, body), = run(SearchService(BrokenEngine()), "/search?q=fool")
+    assert status == 500
+    assert "broken" in body["error"]
+
+
+def test_slow_query():
+    started, release = threading.Event(), threading.Event()
+
+    class SlowEngine:
+        def search(self, query, k=None):
+            started.set()
+            assert release.wait(timeout=5)
+            return []
+
+    async def main():
+        service = SearchService(SlowEngine())
+        await service.start(port=0)
+        async with service.server:
+            slow = asyncio.create_task(get(service.port, "/search?q=slow"))
+            assert await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            # answered while the slow query still runs
+            status, body = await get(service.port, "/index")
+            release.set()
+            return status, await slow
+
+    status, (slow_status, slow_body) = asyncio.run(main())
+    assert status == 404
+    assert slow_status == 200
+
+
+def test_keep_alive():
+    async def main():
+        service = SearchService(make_sample_engine())
+        await service.start(port=0)
+        async with service.server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", service.port)
+            statuses = []
+            for _ in range(3):
+                writer.write(b"GET /search?q=romeo HTTP/1.1\r\n\r\n")
+                statuses.append(int((await reader.readline()).split()[1]))
+                length = 0
+                while (line := await reader.readline()) != b"\r\n":
+                    if line.lower().startswith(b"content-length"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+            writer.close()
+            return statuses
+
+    assert asyncio.run(main()) == [200, 200, 200]
+
+
+def test_swap():
+    built = threading.Event()
+    answered = threading.Event()
+
+    def make_engine():
+        # the new engine is only done after the old one answered a query
+        assert answered.wait(timeout=5)
+        scorer = Scorer()
+        engine = SearchEngine(Indexer(Tokenizer(set()), scorer), PageRank(scorer))
+        engine.start([("f.com", "to be or not to be", ["a.com"]), ("a.com", "romeo", [])])
+        built.set()
+        return engine
+
+    async def main():
+        service = SearchService(make_sample_engine())
+        await service.start(port=0)
+        async with service.server:
+            rebuild = asyncio.create_task(service.rebuild(make_engine))
+            during = await get(service.port, "/search?q=madness")
+            answered.set()
+            await rebuild
+            after = await get(service.port, "/search?q=be")
+            return during, after
+
+    (_, during), (_, after) = asyncio.run(main())
+    assert built.is_set()
+    assert [result["url"] for result in during["results"]] == ["e.com"]
+    assert [result["url"] for result in after["results"]] == ["f.com"]
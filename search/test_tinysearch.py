@@ -1,5 +1,9 @@
 """ tests """
 import logging
+import pytest
+from compact import encode_varints, decode_varints
+from segment import SegmentError
+from query import QueryError
 from tinysearch import *
 
 pages = [
@@ -70,6 +74,355 @@ def check_search_engine(pages):
                 print("no results")
 
 
+def make_engine(cache=None, **indexer_options):
+    stop_words = {"the", "a", "an", "is", "this", "to"}
+    tokenizer = Tokenizer(stop_words)
+    scorer = Scorer()
+    indexer = Indexer(tokenizer, scorer, **indexer_options)
+    ranker = PageRank(scorer)
+    return SearchEngine(indexer, ranker, cache)
+
+
+def test_compact_index():
+    engine = make_engine()
+    engine.start(pages)
+    compact_engine = make_engine(compact=True)
+    compact_engine.start(pages)
+
+    assert sorted(compact_engine.index) == sorted(engine.index)
+    for term, docs in engine.index.items():
+        compact_docs = compact_engine.index[term]
+        assert [url for url, weight in compact_docs] == sorted(url for url, weight in docs)
+        assert dict(compact_docs) == pytest.approx(dict(docs), abs=1e-6)
+        assert compact_engine.index.df(term) == len(docs)
+
+    for query in ["violent delights", "love of wisdom", "psychology science study", "nothing"]:
+        assert dict(compact_engine.search(query)) == pytest.approx(dict(engine.search(query)), abs=1e-6)
+
+
+def test_weighted_index():
+    indexer = make_engine().indexer
+    weighted_index = indexer.get_weighted_index(indexer.get_count_index(pages), len(pages))
+    assert indexer.get_normalized_index(weighted_index) == indexer.get_index(pages)
+
+
+def test_parallel_index_build():
+    indexer = make_engine().indexer
+    assert indexer.build_index(pages, workers=3) == indexer.get_index(pages)
+
+
+def test_bulk_tokenize():
+    tokenizer = make_engine().indexer.tokenizer
+    contents = ["The Fool's café, naïve: K2 ÇA_va?!", "", "to be or not to be", "İstanbul x\ty\nZ 42"]
+    vocabulary = Vocabulary(tokenizer.stop_words)
+    term_ids, lengths = tokenizer.bulk_tokenize(contents, vocabulary)
+    tokens = [list(tokenizer.token_generator(content)) for content in contents]
+    assert lengths.tolist() == [len(document_tokens) for document_tokens in tokens]
+    assert [vocabulary.terms[term_id] for term_id in term_ids] == [token for document in tokens for token in document]
+
+
+def test_posting_arrays():
+    indexer = make_engine().indexer
+    mixed_pages = pages + [("empty.com", "", []), ("stop.com", "the a an", []), ("again.com", "Fool FOOL fool", [])]
+
+    def postings(posting_arrays):
+        terms, urls, term_ids, doc_ids, values = posting_arrays
+        return [(terms[term_id], urls[doc_id], value) for term_id, doc_id, value in zip(term_ids, doc_ids, values)]
+
+    expected = postings(indexer.to_arrays(indexer.get_count_index(mixed_pages)))
+    for batch_size in [1, 2, 1024]:
+        assert postings(indexer.get_posting_arrays(mixed_pages, batch_size)) == expected
+    assert postings(indexer.get_sharded_posting_arrays(mixed_pages, workers=2)) == expected
+
+
+def test_sparse_page_rank():
+    ranker = PageRank(Scorer())
+    assert ranker.create_page_rank(pages) == pytest.approx(ranker.create_dense_page_rank(pages), abs=1e-6)
+
+    # links outside the crawl, duplicate links and self links
+    odd_pages = [
+        ("a.com", "", ["a.com", "b.com", "b.com", "x.com"]),
+        ("b.com", "", ["c.com"]),
+        ("c.com", "", []),
+    ]
+    assert ranker.create_page_rank(odd_pages) == pytest.approx(ranker.create_dense_page_rank(odd_pages), abs=1e-6)
+    # no rank leaks through the links that lead nowhere
+    assert sum(ranker.create_page_rank(odd_pages).values()) == pytest.approx(1, abs=0.002)
+
+
+def test_power_iteration():
+    from solver import PowerIteration
+
+    link_graph = PageRank(Scorer()).create_link_graph(pages)
+    plain = PageRank(Scorer(), PowerIteration())
+    extrapolated = PageRank(Scorer(), PowerIteration(extrapolate_every=5))
+    for ranker in (plain, extrapolated):
+        ranker.teleport_rate = 0.01
+    ranks = plain.sparse_power_method(len(pages), link_graph)
+    assert extrapolated.sparse_power_method(len(pages), link_graph) == pytest.approx(ranks, abs=1e-8)
+    assert plain.solver.stats.converged and extrapolated.solver.stats.converged
+    assert plain.solver.stats.residual < plain.solver.tolerance
+    assert extrapolated.solver.stats.iterations < plain.solver.stats.iterations
+
+    # starting from the answer there is nothing left to do
+    assert plain.sparse_power_method(len(pages), link_graph, np.array(ranks)) == pytest.approx(ranks)
+    assert plain.solver.stats.iterations == 1
+
+    capped = PageRank(Scorer(), PowerIteration(max_iterations=3))
+    capped.sparse_power_method(len(pages), link_graph)
+    assert capped.solver.stats.iterations == 3 and not capped.solver.stats.converged
+
+
+def test_incremental_index():
+    queries = ["violent delights", "love of wisdom", "psychology science study", "romeo fool", "nothing"]
+
+    def assert_same_results(engine, pages):
+        expected = make_engine()
+        expected.start(pages)
+        assert sorted(engine.index) == sorted(expected.index)
+        for query in queries:
+            assert dict(engine.search(query)) == pytest.approx(dict(expected.search(query)), abs=1e-6)
+        assert engine.page_rank == pytest.approx(expected.page_rank, abs=1e-6)
+
+    engine = make_engine()
+    engine.add_pages(pages[:3])
+    engine.add_pages(pages[3:])
+    assert_same_results(engine, pages)
+
+    engine.remove_pages(["b.com", "phil.com"])
+    updated_page = ("d.com", "Love all, trust a few, do wrong to none. Violent delights", ["a.com"])
+    engine.update_page(updated_page)
+    remaining_pages = [page for page in pages if page[0] not in ("b.com", "d.com", "phil.com")]
+    assert_same_results(engine, remaining_pages + [updated_page])
+
+    started_engine = make_engine()
+    started_engine.start(pages)
+    with pytest.raises(ValueError):
+        started_engine.add_pages(pages)
+
+
+def test_top_k_search():
+    engine = make_engine()
+    engine.start(pages)
+    for query in ["violent delights", "study of mind", "philosophy psychology science", "fool", "nothing"]:
+        all_results = engine.search(query)
+        for k in [1, 2, 5, 20]:
+            results = engine.search(query, k=k)
+            assert len(results) == min(k, len(all_results))
+            assert [score for url, score in results] == pytest.approx([score for url, score in all_results[:k]])
+
+
+def test_tiered_top_k_search():
+    queries = ["violent delights", "study of mind", "philosophy psychology science", "fool", "nothing", '"wise man"']
+    engine = make_engine()
+    engine.start(pages)
+    for tier_size in [1, 2, 100]:
+        tiered_engine = SearchEngine(engine.indexer, engine.ranker, tier_size=tier_size)
+        tiered_engine.start(pages)
+        for query in queries:
+            all_results = engine.search(query)
+            for k in [1, 2, 5]:
+                results = tiered_engine.search(query, k=k)
+                assert len(results) == min(k, len(all_results))
+                assert [score for url, score in results] == pytest.approx([score for url, score in all_results[:k]])
+
+        tiered_index = tiered_engine.tiered_index
+        if tier_size == 1:
+            # one posting per term is too few to settle some queries, they read the tails too
+            assert 0 < tiered_index.first_tier_answers < tiered_index.queries
+        if tier_size == 100:
+            # every posting is in the first tiers
+            assert tiered_index.first_tier_answers == tiered_index.queries
+
+    # weights of a term in all but one page round to 0, the pages in its tail still match
+    common_pages = [(f"{i}.com", f"common unique{i}", []) for i in range(1000)] + [("other.com", "other", [])]
+    tiered_engine = SearchEngine(engine.indexer, engine.ranker, tier_size=2)
+    tiered_engine.start(common_pages)
+    assert len(tiered_engine.search("common", k=5)) == 5
+
+
+def test_terms_in_every_page():
+    engine = make_engine()
+    engine.start([("a.com", "romeo and juliet", []), ("b.com", "romeo", [])])
+    # romeo has no weight, it doesn't tell the pages apart
+    assert engine.search("romeo") == []
+    assert engine.search("romeo", k=1) == []
+    assert engine.search("romeo juliet")[0][0] == "a.com"
+
+
+def test_segment(tmp_path):
+    engine = make_engine()
+    engine.start(pages)
+    engine.save(tmp_path / "index.seg")
+
+    opened_engine = make_engine()
+    opened_engine.open(tmp_path / "index.seg")
+    assert opened_engine.number_of_pages == len(pages)
+    assert dict(opened_engine.page_rank.items()) == pytest.approx(engine.page_rank)
+    for query in ["violent delights", "love of wisdom", "psychology science study", "nothing"]:
+        assert dict(opened_engine.search(query)) == pytest.approx(dict(engine.search(query)), abs=1e-6)
+        assert dict(opened_engine.search(query, k=3)) == pytest.approx(dict(engine.search(query, k=3)), abs=1e-6)
+
+    (tmp_path / "broken.seg").write_bytes(b"not a segment" * 10)
+    with pytest.raises(SegmentError):
+        opened_engine.open(tmp_path / "broken.seg")
+
+    # a segment weighted by another scorer would mix its weights with the wrong query weights
+    bm25_engine = SearchEngine(Indexer(engine.indexer.tokenizer, BM25()), PageRank(BM25()))
+    with pytest.raises(SegmentError):
+        bm25_engine.open(tmp_path / "index.seg")
+
+
+def test_query_cache():
+    engine = make_engine(cache=QueryCache())
+    engine.add_pages(pages)
+    expected = engine.search("violent delights")
+    assert expected
+    # same terms after tokenizing
+    assert engine.search("Delights, VIOLENT!") == expected
+    assert dict(engine.search("violent delights", k=2)) == pytest.approx(dict(expected[:2]))
+    assert (engine.cache.hits, engine.cache.misses) == (1, 2)
+
+    engine.update_page(("a.com", "violent delights in romeo", ["b.com"]))
+    results = engine.search("violent delights")
+    assert engine.cache.misses == 3
+    assert "a.com" in dict(results)
+
+    # an unknown url removes nothing, the cached results are still right
+    with pytest.raises(KeyError):
+        engine.remove_pages(["a.com", "nope.com"])
+    assert engine.search("violent delights") == results
+    engine.remove_pages(["a.com"])
+    assert "a.com" not in dict(engine.search("violent delights"))
+
+    small_cache = QueryCache(max_bytes=QueryCache.get_size((frozenset(), None), []) * 3)
+    engine = make_engine(cache=small_cache)
+    engine.start(pages)
+    for query in ["", "nothing", "nowhere", "no one"]:
+        engine.search(query)
+    assert len(small_cache) < 4
+    assert small_cache.nbytes <= small_cache.max_bytes
+
+
+def test_phrase_queries():
+    def urls(results):
+        return [url for url, score in results]
+
+    engine = make_engine(positions=True)
+    engine.start(pages)
+    assert urls(engine.search('"violent delights"')) == ["b.com"]
+    assert urls(engine.search('"violent delights"', k=3)) == ["b.com"]
+    assert engine.search('"delights violent"') == []
+    assert urls(engine.search('"delights violent"~1')) == ["b.com"]
+    # a repeated term needs a position for every time it is in the phrase
+    assert urls(engine.search('"violent violent"~2')) == ["b.com"]
+    assert urls(engine.search('"wise wise"~2')) == ["c.com"]
+    assert engine.search('"romeo romeo"~3') == []
+    # stop words still take up their position
+    assert urls(engine.search('"think he is wise"')) == ["c.com"]
+    assert engine.search('"think wise"') == []
+    assert set(urls(engine.search('"study of" mind'))) == {"phil.com", "pols.com", "psy.com"}
+    # a phrase of stop words is left out, like in a boolean query
+    assert urls(engine.search('"the a" romeo')) == urls(engine.search('"the a" AND romeo')) == ["a.com"]
+    assert engine.positional_index.nbytes > 0
+
+    engine = make_engine(positions=True)
+    engine.add_pages(pages)
+    engine.remove_pages(["b.com"])
+    assert engine.search('"violent delights"') == []
+    engine.update_page(("a.com", "violent delights", []))
+    assert urls(engine.search('"violent delights"')) == ["a.com"]
+
+    # without positions quotes are ignored
+    engine = make_engine()
+    engine.start(pages)
+    assert urls(engine.search('"delights violent"')) == ["b.com"]
+
+
+def test_boolean_queries():
+    def urls(results):
+        return {url for url, score in results}
+
+    engine = make_engine()
+    engine.start(pages)
+    assert urls(engine.search("violent AND delights")) == {"b.com"}
+    assert urls(engine.search("study AND mind")) == {"phil.com", "psy.com"}
+    assert urls(engine.search("study AND NOT mind")) == {"pols.com"}
+    assert urls(engine.search("(romeo OR fool) AND NOT wise")) == {"a.com"}
+    assert urls(engine.search("romeo OR fool")) == urls(engine.search("romeo fool"))
+    assert urls(engine.search("NOT (study OR the)")) == {"a.com", "b.com", "c.com", "d.com", "e.com"}
+    assert engine.search("romeo AND fool") == []
+
+    # scores are the same as for a plain query
+    expected = dict(engine.search("psychology science"))
+    results = dict(engine.search("psychology AND science"))
+    assert results == pytest.approx({url: expected[url] for url in results})
+    assert engine.search("study AND mind", k=1) == engine.search("study AND mind")[:1]
+
+    positional_engine = make_engine(positions=True)
+    positional_engine.start(pages)
+    assert urls(positional_engine.search('"study of" AND NOT politics')) == {"phil.com", "psy.com"}
+    assert urls(positional_engine.search('"of study"~1 AND psychology')) == {"psy.com"}
+
+    # queries that don't parse and stray parentheses are plain queries
+    assert engine.search("romeo AND (fool") == engine.search("romeo and fool")
+    assert engine.search("romeo OR") == engine.search("romeo or")
+    assert engine.search("(romeo fool") == engine.search("romeo fool")
+    assert engine.search("fool) romeo (") == engine.search("romeo fool")
+    with pytest.raises(QueryError):
+        QueryParser(engine.indexer.tokenizer).parse("romeo AND (fool")
+
+
+def test_varints():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 21, 2 ** 35], dtype=np.int64)
+    buffer, lengths = encode_varints(values)
+    assert lengths.tolist() == [1, 1, 1, 2, 2, 4, 6]
+    assert decode_varints(buffer).tolist() == values.tolist()
+
+
+def test_fuzzy_search():
+    from fuzzy import CompactDeleteIndex, edit_distance
+
+    engine = make_engine()
+    engine.start(pages)
+    vocabulary = list(engine.index)
+    expander = CompactDeleteIndex(vocabulary, max_distance=2)
+    grown = CompactDeleteIndex(vocabulary[:10], max_distance=2)
+    grown.add(vocabulary)
+    assert grown.words == vocabulary
+    for term in ["romoe", "wize", "philosophy", "qestions", "xyzzy"]:
+        for max_distance in (1, 2):
+            expected = {word: edit_distance(term, word) for word in vocabulary}
+            expected = {word: distance for word, distance in expected.items() if distance <= max_distance}
+            assert expander.lookup(term, max_distance) == grown.lookup(term, max_distance) == expected
+    with pytest.raises(ValueError):
+        expander.lookup("romeo", 3)
+
+    assert engine.search("romoe") == []
+    engine.fuzzy_distance = 1
+    assert [url for url, score in engine.search("romoe")] == ["a.com"]
+    assert {url for url, score in engine.search("wize")} == {"c.com"}
+    assert engine.expand_terms({"wise"}) == {"wise"}
+    assert engine.expand_terms({"questios"}) == {"questions", "questios"}
+
+    compact_engine = make_engine(compact=True)
+    compact_engine.start(pages)
+    compact_engine.fuzzy_distance = 1
+    assert dict(compact_engine.search("romoe wize")) == pytest.approx(dict(engine.search("romoe wize")))
+
+    # pages added later only add their new terms to the expander
+    engine = make_engine()
+    engine.fuzzy_distance = 1
+    engine.add_pages(pages[:3])
+    assert engine.search("madnes") == []
+    expander = engine.term_expander
+    engine.add_pages(pages[3:])
+    assert [url for url, score in engine.search("madnes")] == ["e.com"]
+    assert engine.term_expander is expander
+    engine.remove_pages(["a.com"])
+    assert engine.expand_terms({"romoe"}) == {"romoe"}
+
+
 if __name__ == "__main__":
     logging.getLogger().setLevel("DEBUG")
     check_search_engine(pages)
@@ -1,103 +1,633 @@
+import os
 import re
+import sys
 import math
+import heapq
 import operator
 import logging
-from collections import defaultdict, Counter
+from itertools import chain
+from collections import defaultdict, Counter, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from compact import CompactIndex
+from segment import save_segment, open_segment, SegmentError
+from postings import PositionalIndex
+from query import QueryParser, QueryEvaluator, DocIdIndex, QueryError, is_boolean, positive_terms
+from fuzzy import CompactDeleteIndex
+from solver import PowerIteration
+from bm25 import BM25, FieldIndex
+
+
+class Vocabulary(dict):
+    """utf-8 token -> term id, new tokens get the next id as they come up, stop words are -1"""
+
+    def __init__(self, stop_words=()):
+        super().__init__((word.encode(), -1) for word in stop_words)
+        self.terms = []
+
+    def __missing__(self, token):
+        self[token] = term_id = len(self.terms)
+        self.terms.append(token.decode())
+        return term_id
+
+    def intern(self, tokens):
+        """term ids of a list of tokens, one dict lookup per token in C, python only runs for new terms"""
+        return np.fromiter(map(self.__getitem__, tokens), dtype=np.int64, count=len(tokens))
 
 
 class Tokenizer:
-    def __init__(self, stop_words, ):
+    letters_and_digits_only = re.compile('[a-z0-9]+')
+    # bytes that are not in a token become spaces, so bytes.split finds the same tokens as the pattern,
+    # utf-8 encodes every other character with bytes over 127
+    letters_and_digits_table = bytes(byte if byte in b"abcdefghijklmnopqrstuvwxyz0123456789" else ord(" ")
+                                     for byte in range(256))
+
+    def __init__(self, stop_words, corrector=None):
         self.stop_words = stop_words
+        # a fuzzy.SpellCorrector for the did you mean stage
+        self.corrector = corrector
+
+    def get_corrections(self, tokens, vocabulary=None):
+        """
+        {token: most likely spelling} of the tokens that are not in vocabulary, like the terms of an index,
+        a word the index has is what the user meant even when the dictionary of the corrector doesn't know it
+        """
+        if self.corrector is None:
+            return {}
+        misses = [token for token in dict.fromkeys(tokens) if vocabulary is None or token not in vocabulary]
+        corrections = dict(zip(misses, self.corrector.correct_stream(misses)))
+        corrected = {token: correction for token, correction in corrections.items() if token != correction}
+        if corrected:
+            logging.info(f"did you mean {corrected}")
+        return corrected
 
-    def token_generator(self, s):
-        letters_and_digits_only = re.compile('[a-z0-9]+')
-        for token in letters_and_digits_only.findall(s.lower()):
+    def token_generator(self, s, correct=False, vocabulary=None):
+        """with correct, tokens missing from vocabulary are replaced by their most likely spelling"""
+        tokens = self.letters_and_digits_only.findall(s.lower())
+        corrections = self.get_corrections(tokens, vocabulary) if correct else {}
+        for token in tokens:
+            token = corrections.get(token, token)
             if token not in self.stop_words:
                 yield token
 
+    def position_generator(self, s, correct=False, vocabulary=None):
+        """(position, token) pairs, stop words are skipped but still take up a position"""
+        tokens = self.letters_and_digits_only.findall(s.lower())
+        corrections = self.get_corrections(tokens, vocabulary) if correct else {}
+        for position, token in enumerate(tokens):
+            token = corrections.get(token, token)
+            if token not in self.stop_words:
+                yield position, token
+
+    def bulk_tokenize(self, contents, vocabulary):
+        """
+        term ids of the tokens of a batch of documents, stop words left out, and how many each document has
+
+        the same tokens as token_generator, without a string or a python loop per token,
+        every document is split in C and its tokens are interned into the vocabulary
+        """
+        tokens_by_document = [content.lower().encode().translate(self.letters_and_digits_table).split()
+                              for content in contents]
+        term_ids = vocabulary.intern(list(chain.from_iterable(tokens_by_document)))
+        lengths = np.fromiter(map(len, tokens_by_document), dtype=np.int64, count=len(tokens_by_document))
+        document_numbers = np.repeat(np.arange(len(tokens_by_document)), lengths)
+        is_term = term_ids >= 0
+        return term_ids[is_term], np.bincount(document_numbers[is_term], minlength=len(tokens_by_document))
+
 
 class Scorer:
+    """
+    log tf x idf weights, normalized to unit length per page, scored by cosine similarity
+
+    a scorer turns counts into the weights of an index, see get_weights and get_postings,
+    and query terms into query weights, bm25.BM25 is another one
+    """
+
     @staticmethod
     def get_tf_idf(tf, number_of_pages, df):
         weighted_tf = 1 + math.log10(tf)
         idf = math.log10(number_of_pages / df)
         return weighted_tf * idf
 
+    @staticmethod
+    def get_tf_idfs(tfs, number_of_pages, dfs):
+        """get_tf_idf over numpy arrays"""
+        weighted_tfs = 1 + np.log10(tfs)
+        idfs = np.log10(number_of_pages / dfs)
+        return weighted_tfs * idfs
+
+    def get_weights(self, posting_arrays, number_of_pages, normalize=True):
+        """weights of the postings of Indexer.get_posting_arrays, df of a term is the length of its posting list"""
+        dfs = np.bincount(posting_arrays.term_ids, minlength=len(posting_arrays.terms))
+        weights = self.get_tf_idfs(posting_arrays.values, number_of_pages, dfs[posting_arrays.term_ids])
+        return self.get_normalized_weights(posting_arrays, weights) if normalize else weights
+
+    @staticmethod
+    def get_normalized_weights(posting_arrays, weights):
+        # normalize tf-idf weights, every doc norm is computed once
+        squared_norms = np.bincount(posting_arrays.doc_ids, weights=weights ** 2, minlength=len(posting_arrays.urls))
+        doc_norms = np.sqrt(squared_norms)[posting_arrays.doc_ids]
+        has_norm = doc_norms != 0
+        normalized_weights = weights.copy()
+        normalized_weights[has_norm] = np.round(weights[has_norm] / doc_norms[has_norm], 3)
+        return normalized_weights
+
+    def get_query_weights(self, dfs, number_of_pages):
+        """term -> df of the query terms in the index"""
+        query_tf_idfs = {term: self.get_tf_idf(1, number_of_pages, df) for term, df in dfs.items()}
+        query_vector_norm = np.linalg.norm(list(query_tf_idfs.values()))
+        if not query_vector_norm:
+            # terms in every page have no weight, like stop words
+            return {}
+        return {term: query_tf_idf / query_vector_norm for term, query_tf_idf in query_tf_idfs.items()}
+
+    def get_postings(self, index, term):
+        """weighted postings of a term of an IncrementalIndex"""
+        docs = index.postings[term]
+        df = len(docs)
+        normalized_docs = []
+        for url, count in docs.items():
+            weight = self.get_tf_idf(count, index.number_of_pages, df)
+            doc_norm = index.doc_norm(url)
+            if doc_norm == 0:
+                normalized_weight = weight
+            else:
+                normalized_weight = round(weight / doc_norm, 3)
+            normalized_docs.append((url, normalized_weight))
+        return normalized_docs
+
+
+# a posting list as parallel arrays, term_ids and doc_ids point into terms and urls
+PostingArrays = namedtuple("PostingArrays", ["terms", "urls", "term_ids", "doc_ids", "values"])
+
 
 class Indexer:
-    def __init__(self, tokenizer, scorer):
+    def __init__(self, tokenizer, scorer, compact=False, positions=False):
         self.tokenizer = tokenizer
         self.scorer = scorer
+        # pack the final index into numpy arrays, see compact.py
+        self.compact = compact
+        # also build a positional index for phrase queries, see postings.py
+        self.positions = positions
+
+    def get_counts(self, content):
+        return Counter(self.tokenizer.token_generator(content))
+
+    def get_positions(self, content):
+        positions = defaultdict(list)
+        for position, token in self.tokenizer.position_generator(content):
+            positions[token].append(position)
+        return positions
+
+    def get_positional_index(self, pages):
+        positional_index = PositionalIndex()
+        for url, content, links in pages:
+            positional_index.add(url, self.get_positions(content))
+        logging.info(f"positional index takes {positional_index.nbytes / 2 ** 20:.1f} MiB")
+        return positional_index
+
+    def get_posting_arrays(self, pages, batch_size=1024):
+        """
+        term counts of the pages as posting arrays, the same postings as to_arrays(get_count_index(pages))
+
+        pages are tokenized in batches straight into term ids and counted with numpy, no Counter per page
+        """
+        vocabulary = Vocabulary(self.tokenizer.stop_words)
+        urls, term_ids, doc_ids, counts = [], [], [], []
+        pages = iter(pages)
+        while batch := [page for _, page in zip(range(batch_size), pages)]:
+            batch_term_ids, lengths = self.tokenizer.bulk_tokenize([content for url, content, links in batch],
+                                                                   vocabulary)
+            # count every (page, term) pair of the batch at once
+            number_of_terms = len(vocabulary.terms)
+            keys = np.repeat(np.arange(len(urls), len(urls) + len(batch)), lengths) * number_of_terms + batch_term_ids
+            keys, batch_counts = np.unique(keys, return_counts=True)
+            batch_doc_ids, batch_term_ids = np.divmod(keys, number_of_terms)
+            urls.extend(url for url, content, links in batch)
+            term_ids.append(batch_term_ids)
+            doc_ids.append(batch_doc_ids)
+            counts.append(batch_counts)
+        if not term_ids:
+            return PostingArrays([], [], np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0))
+        term_ids, doc_ids, counts = np.concatenate(term_ids), np.concatenate(doc_ids), np.concatenate(counts)
+        # grouped by term, pages in order within a term
+        by_term = np.argsort(term_ids, kind="stable")
+        return PostingArrays(vocabulary.terms, urls, term_ids[by_term], doc_ids[by_term],
+                             counts[by_term].astype(np.float64))
 
     def get_count_index(self, pages):
         # count terms
         count_index = defaultdict(list)
         for url, content, links in pages:
-            counts = Counter(self.tokenizer.token_generator(content))
+            counts = self.get_counts(content)
             for token, count in counts.items():
                 count_index[token].append((url, count))
         return count_index
 
+    @staticmethod
+    def to_arrays(index):
+        """flatten a dict index into (term id, doc id, value) arrays, grouped by term in posting order"""
+        terms = list(index)
+        doc_id_by_url = {}
+        term_ids, doc_ids, values = [], [], []
+        for term_id, term in enumerate(terms):
+            docs = index[term]
+            term_ids.extend([term_id] * len(docs))
+            for url, value in docs:
+                doc_ids.append(doc_id_by_url.setdefault(url, len(doc_id_by_url)))
+                values.append(value)
+        return PostingArrays(
+            terms,
+            list(doc_id_by_url),
+            np.array(term_ids, dtype=np.int64),
+            np.array(doc_ids, dtype=np.int64),
+            np.array(values, dtype=np.float64),
+        )
+
+    @staticmethod
+    def to_index(posting_arrays, values):
+        terms, urls, term_ids, doc_ids, _ = posting_arrays
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        doc_ids, values, offsets = doc_ids.tolist(), values.tolist(), offsets.tolist()
+        index = defaultdict(list)
+        for term_id, term in enumerate(terms):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            index[term] = [(urls[doc_id], value) for doc_id, value in zip(doc_ids[start:end], values[start:end])]
+        return index
+
     def get_weighted_index(self, count_index, number_of_pages):
-        # add tf-idf weights
-        weighted_index = defaultdict(list)
-        for token, docs in count_index.items():
-            df = len(docs)
-            for url, count in docs:
-                weight = self.scorer.get_tf_idf(count, number_of_pages, df)
-                weighted_index[token].append((url, weight))
-        return weighted_index
+        # weights of the scorer, before they are normalized
+        posting_arrays = self.to_arrays(count_index)
+        return self.to_index(posting_arrays, self.scorer.get_weights(posting_arrays, number_of_pages, normalize=False))
 
     def get_normalized_index(self, weighted_index):
-        # normalize tf-idf weights
-        weights_by_url = defaultdict(list)
-        for docs in weighted_index.values():
-            for url, weight in docs:
-                weights_by_url[url].append(weight)
-
-        normalized_index = defaultdict(list)
-        for term, docs in weighted_index.items():
-            for url, weight in docs:
-                doc_norm = np.linalg.norm(weights_by_url.get(url))
-                if doc_norm == 0:
-                    normalized_weight = weight
-                else:
-                    normalized_weight = round(weight / doc_norm, 3)
-                normalized_index[term].append((url, normalized_weight))
-
-        return normalized_index
+        posting_arrays = self.to_arrays(weighted_index)
+        return self.to_index(posting_arrays, Scorer.get_normalized_weights(posting_arrays, posting_arrays.values))
+
+    def get_sharded_posting_arrays(self, pages, workers):
+        """
+        get_posting_arrays of contiguous shards in parallel, merged into the same arrays as the serial build
+
+        every shard numbers its own terms, a remap takes them to one vocabulary in the order they first come up
+        """
+        shard_size = math.ceil(len(pages) / (workers * 4))
+        shards = [pages[i:i + shard_size] for i in range(0, len(pages), shard_size)]
+        term_id_by_term = {}
+        urls, term_ids, doc_ids, counts = [], [], [], []
+        with ProcessPoolExecutor(workers) as executor:
+            for shard_terms, shard_urls, shard_term_ids, shard_doc_ids, shard_counts in executor.map(
+                    self.get_posting_arrays, shards):
+                remap = np.array([term_id_by_term.setdefault(term, len(term_id_by_term)) for term in shard_terms],
+                                 dtype=np.int64)
+                term_ids.append(remap[shard_term_ids])
+                doc_ids.append(shard_doc_ids + len(urls))
+                counts.append(shard_counts)
+                urls.extend(shard_urls)
+        if not term_ids:
+            return PostingArrays([], [], np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0))
+        term_ids, doc_ids, counts = np.concatenate(term_ids), np.concatenate(doc_ids), np.concatenate(counts)
+        # shards are in page order, a stable sort by term keeps the pages in order within a term
+        by_term = np.argsort(term_ids, kind="stable")
+        return PostingArrays(list(term_id_by_term), urls, term_ids[by_term], doc_ids[by_term], counts[by_term])
 
     def get_index(self, pages):
+        return self.build_index(pages, workers=1)
+
+    def build_index(self, pages, workers=None):
+        """workers is the number of tokenizing processes, defaults to the number of cpus"""
+        pages = list(pages)
         number_of_pages = len(pages)
-        count_index = self.get_count_index(pages)
-        weighted_index = self.get_weighted_index(count_index, number_of_pages)
-        normalized_index = self.get_normalized_index(weighted_index)
-        return normalized_index
+        workers = min(workers or os.cpu_count(), number_of_pages)
+        if workers > 1:
+            posting_arrays = self.get_sharded_posting_arrays(pages, workers)
+        else:
+            posting_arrays = self.get_posting_arrays(pages)
+        if isinstance(self.scorer, BM25) and not self.compact:
+            # weighted when queried, so more fields can be added, see SearchEngine.add_field
+            index = FieldIndex(self.scorer, [url for url, content, links in pages])
+            index.add_field("content", posting_arrays)
+            return index
+        weights = self.scorer.get_weights(posting_arrays, number_of_pages)
+        if self.compact:
+            terms, urls, term_ids, doc_ids, _ = posting_arrays
+            return CompactIndex.from_arrays(terms, urls, term_ids, doc_ids, weights)
+        return self.to_index(posting_arrays, weights)
 
 
-class PageRank:
+class IncrementalIndex:
+    """
+    keeps raw term counts per page so pages can be added and removed one by one
+
+    index[term] returns the same weighted (url, weight) pairs as Indexer.get_index, see the get_postings of the scorer,
+    weights and doc norms are computed when a term is queried, norms are cached until the next change
+    """
+
     def __init__(self, scorer):
-        self.max_iterations = 10000
+        self.scorer = scorer
+        self.postings = {}  # term -> {url: count}
+        self.doc_counts = {}  # url -> Counter
+        self.doc_lengths = {}  # url -> number of terms
+        self.total_length = 0
+        self.generation = 0
+        self.doc_norms = {}
+        self.doc_norms_generation = 0
+
+    @property
+    def number_of_pages(self):
+        return len(self.doc_counts)
+
+    def add(self, url, counts):
+        if url in self.doc_counts:
+            self.remove(url)
+        self.doc_counts[url] = counts
+        self.doc_lengths[url] = sum(counts.values())
+        self.total_length += self.doc_lengths[url]
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[url] = count
+        self.generation += 1
+
+    def remove(self, url):
+        counts = self.doc_counts.pop(url)
+        self.total_length -= self.doc_lengths.pop(url)
+        for term in counts:
+            docs = self.postings[term]
+            del docs[url]
+            if not docs:
+                del self.postings[term]
+        self.generation += 1
+
+    def doc_norm(self, url):
+        # any change moves N or some df, which moves every norm
+        if self.doc_norms_generation != self.generation:
+            self.doc_norms = {}
+            self.doc_norms_generation = self.generation
+        doc_norm = self.doc_norms.get(url)
+        if doc_norm is None:
+            weights = [
+                self.scorer.get_tf_idf(count, self.number_of_pages, len(self.postings[term]))
+                for term, count in self.doc_counts[url].items()
+            ]
+            doc_norm = self.doc_norms[url] = np.linalg.norm(weights)
+        return doc_norm
+
+    def __getitem__(self, term):
+        return self.scorer.get_postings(self, term)
+
+    def df(self, term):
+        return len(self.postings.get(term, ()))
+
+    def __contains__(self, term):
+        return term in self.postings
+
+    def __len__(self):
+        return len(self.postings)
+
+    def __iter__(self):
+        return iter(self.postings)
+
+
+class ImpactIndex:
+    """
+    postings of any index as (url, weight * page rank), highest first, with random access by url
+
+    terms are sorted the first time they are queried
+    """
+
+    def __init__(self, index, page_rank):
+        self.index = index
+        self.page_rank = page_rank
+        self.impact_postings = {}
+        self.impacts = {}
+
+    def __getitem__(self, term):
+        docs = self.impact_postings.get(term)
+        if docs is None:
+            docs = [(url, weight * self.page_rank.get(url)) for url, weight in self.index[term]]
+            docs.sort(key=operator.itemgetter(1), reverse=True)
+            self.impact_postings[term] = docs
+            self.impacts[term] = dict(docs)
+        return docs
+
+    def get_impact(self, term, url):
+        self[term]
+        return self.impacts[term].get(url, 0)
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+
+# postings of a term by impact, highest first, the first tier_size of them are the first tier,
+# the tail again by doc id for random access, tail_impact is the highest impact of the tail, 0 without a tail
+Tier = namedtuple("Tier", ["doc_ids", "impacts", "tail_doc_ids", "tail_impacts", "tail_impact"])
+
+
+class TieredIndex:
+    """
+    impact ordered postings of any index in two tiers, the tier_size highest impacts of a term and the tail
+
+    tiers are numpy arrays of doc ids, positions in urls, and impacts, built the first time a term is queried,
+    a top k query reads the tail only when the first tiers can't tell the best k pages apart from the rest
+    """
+
+    def __init__(self, index, page_rank, tier_size=256):
+        self.index = index
+        self.page_rank = page_rank
+        self.tier_size = tier_size
+        self.urls = []
+        self.doc_ids = {}
+        self.tiers = {}
+        # how many top k queries the first tiers answered, of how many
+        self.first_tier_answers = self.queries = 0
+
+    def __getitem__(self, term):
+        tier = self.tiers.get(term)
+        if tier is None:
+            docs = self.index[term]
+            doc_ids = np.fromiter(map(self.get_doc_id, (url for url, weight in docs)), dtype=np.int64, count=len(docs))
+            impacts = np.fromiter((weight * self.page_rank.get(url) for url, weight in docs), dtype=np.float64,
+                                  count=len(docs))
+            order = np.argsort(-impacts, kind="stable")
+            doc_ids, impacts = doc_ids[order], impacts[order]
+            tail = np.argsort(doc_ids[self.tier_size:])
+            tail_doc_ids, tail_impacts = doc_ids[self.tier_size:][tail], impacts[self.tier_size:][tail]
+            tail_impact = impacts[self.tier_size] if len(impacts) > self.tier_size else 0.0
+            tier = self.tiers[term] = Tier(doc_ids, impacts, tail_doc_ids, tail_impacts, tail_impact)
+        return tier
+
+    def get_doc_id(self, url):
+        doc_id = self.doc_ids.get(url)
+        if doc_id is None:
+            doc_id = self.doc_ids[url] = len(self.urls)
+            self.urls.append(url)
+        return doc_id
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+
+# CSR adjacency: links of page i are indices[indptr[i]:indptr[i+1]] with probabilities in data
+LinkGraph = namedtuple("LinkGraph", ["indptr", "indices", "data", "dangling"])
+
+
+class PageRank:
+    def __init__(self, scorer, solver=None):
         self.teleport_rate = 0.1
         self.page_rank = None
         self.scorer = scorer
+        # solver.stats tells how the last ranking went
+        self.solver = solver or PowerIteration(extrapolate_every=10)
 
-    def get_cosine_similarity_scores(self, index, number_of_pages, query):
-        query_terms = set(query.split())
+    def get_query_weights(self, index, number_of_pages, query_terms):
         related_terms = set(term for term in query_terms if term in index)
+        # compact and incremental indexes count postings without decoding or weighting them
+        df = index.df if hasattr(index, "df") else lambda term: len(index[term])
+        dfs = {term: df(term) for term in related_terms}
+        return self.scorer.get_query_weights(dfs, number_of_pages)
 
-        query_tf_idfs = {term: self.scorer.get_tf_idf(1, number_of_pages, len(index[term])) for term in related_terms}
-        query_vector_norm = np.linalg.norm(list(query_tf_idfs.values()))
+    def get_cosine_similarity_scores(self, index, number_of_pages, query_terms):
+        query_weights = self.get_query_weights(index, number_of_pages, query_terms)
+        if hasattr(index, "arrays"):
+            # array indexes add up the scores of all the postings at once
+            return self.get_array_scores(index, query_weights)
 
         scores = defaultdict(int)
-        for term in related_terms:
-            query_term_weight = query_tf_idfs.get(term) / query_vector_norm
+        for term, query_term_weight in query_weights.items():
             for url, weight in index[term]:
                 scores[url] += weight * query_term_weight
 
         return sorted(scores.items(), key=operator.itemgetter(1), reverse=True)
 
+    @staticmethod
+    def get_array_scores(index, query_weights):
+        """get_cosine_similarity_scores of an index with arrays(term), like FieldIndex and CompactIndex"""
+        if not query_weights:
+            return []
+        doc_ids, weights = zip(*(index.arrays(term) for term in query_weights))
+        products = np.concatenate([weight * query_term_weight
+                                   for weight, query_term_weight in zip(weights, query_weights.values())])
+        doc_ids = np.concatenate(doc_ids)
+        scores = np.bincount(doc_ids, weights=products, minlength=len(index.urls))
+        # pages with a posting score, even when its weight is 0
+        matches = np.flatnonzero(np.bincount(doc_ids, minlength=len(index.urls)))
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return list(zip(map(index.urls.__getitem__, matches.tolist()), scores[matches].tolist()))
+
+    def get_top_k_scores(self, impact_index, number_of_pages, query_terms, k, accept=None):
+        """
+        threshold algorithm over impact ordered postings
+
+        the impact of a posting is its weight times the page rank of its page,
+        so the final score of a page is the query weighted sum of its impacts.
+        always read the posting with the biggest contribution next, score every new page fully
+        through random access and keep the best k in a heap, stop once the heads of the lists
+        add up to less than the k-th best score: no unseen page can beat it
+
+        accept filters pages by url, rejected pages are never scored
+        """
+        query_weights = self.get_query_weights(impact_index, number_of_pages, query_terms)
+        query_weights = {term: weight for term, weight in query_weights.items() if weight > 0}
+        if k <= 0:
+            return []
+
+        positions = dict.fromkeys(query_weights, 0)
+        heap = []
+        seen = set()
+        while positions:
+            contributions = {
+                term: query_weights[term] * impact_index[term][position][1] for term, position in positions.items()
+            }
+            if len(heap) == k and heap[0][0] >= sum(contributions.values()):
+                break
+
+            term = max(contributions, key=contributions.get)
+            url, impact = impact_index[term][positions[term]]
+            positions[term] += 1
+            if positions[term] == len(impact_index[term]):
+                del positions[term]
+
+            if url in seen:
+                continue
+            seen.add(url)
+            if accept is not None and not accept(url):
+                continue
+            score = sum(query_weights[term] * impact_index.get_impact(term, url) for term in query_weights)
+            if len(heap) < k:
+                heapq.heappush(heap, (score, url))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, url))
+
+        logging.debug(f"top {k} scored {len(seen)} pages")
+        return [(url, score) for score, url in sorted(heap, reverse=True)]
+
+    def get_tiered_top_k_scores(self, tiered_index, number_of_pages, query_terms, k, accept=None):
+        """
+        the same best k pages as get_top_k_scores, from the first tiers when they settle it
+
+        first tiers give every page they have a partial score, the tails can add at most
+        the query weighted sum of their highest impacts over the terms a page is missing from the first tiers,
+        when the k best partial scores beat every other page even with that added, they are the answer,
+        only their scores are completed from the tails, otherwise every posting of the query terms is scored
+        """
+        query_weights = self.get_query_weights(tiered_index.index, number_of_pages, query_terms)
+        query_weights = {term: weight for term, weight in query_weights.items() if weight > 0}
+        if k <= 0 or not query_weights:
+            return []
+        tiered_index.queries += 1
+        tiers = {term: tiered_index[term] for term in query_weights}
+        tier_size = tiered_index.tier_size
+
+        # partial scores of the pages in the first tiers, and how much the tails can still add to them
+        doc_ids = np.concatenate([tier.doc_ids[:tier_size] for tier in tiers.values()])
+        doc_ids, positions = np.unique(doc_ids, return_inverse=True)
+        partial_scores = np.bincount(positions, minlength=len(doc_ids), weights=np.concatenate(
+            [query_weights[term] * tier.impacts[:tier_size] for term, tier in tiers.items()]))
+        tail_bounds = {term: query_weights[term] * tier.tail_impact for term, tier in tiers.items()}
+        covered_bounds = np.bincount(positions, minlength=len(doc_ids), weights=np.concatenate(
+            [np.full(len(tier.doc_ids[:tier_size]), tail_bounds[term]) for term, tier in tiers.items()]))
+        # pages in none of the first tiers have a partial score of 0
+        unseen_bound = sum(tail_bounds.values())
+        upper_bounds = partial_scores + unseen_bound - covered_bounds
+        if accept is not None:
+            accepted = np.fromiter((accept(tiered_index.urls[doc_id]) for doc_id in doc_ids.tolist()), dtype=bool,
+                                   count=len(doc_ids))
+            doc_ids, partial_scores, upper_bounds = doc_ids[accepted], partial_scores[accepted], upper_bounds[accepted]
+
+        best = np.argsort(-partial_scores, kind="stable")[:k]
+        others = np.ones(len(doc_ids), dtype=bool)
+        others[best] = False
+        best_others = max(upper_bounds[others].max(initial=0), unseen_bound)
+        # without tails every posting is in the first tiers, a tail of 0 impacts still has matching pages
+        has_tails = any(len(tier.tail_doc_ids) for tier in tiers.values())
+        if not has_tails or (len(best) == k and partial_scores[best].min() >= best_others):
+            tiered_index.first_tier_answers += 1
+            doc_ids, scores = doc_ids[best], partial_scores[best]
+            for term, tier in tiers.items():
+                if len(tier.tail_doc_ids):
+                    # at most one posting per page, missing ones match past the end or another doc id
+                    positions = np.minimum(np.searchsorted(tier.tail_doc_ids, doc_ids), len(tier.tail_doc_ids) - 1)
+                    in_tail = tier.tail_doc_ids[positions] == doc_ids
+                    scores = scores + np.where(in_tail, query_weights[term] * tier.tail_impacts[positions], 0)
+        else:
+            doc_ids = np.concatenate([tier.doc_ids for tier in tiers.values()])
+            doc_ids, positions = np.unique(doc_ids, return_inverse=True)
+            scores = np.bincount(positions, minlength=len(doc_ids), weights=np.concatenate(
+                [query_weights[term] * tier.impacts for term, tier in tiers.items()]))
+            if accept is not None:
+                accepted = np.fromiter((accept(tiered_index.urls[doc_id]) for doc_id in doc_ids.tolist()),
+                                       dtype=bool, count=len(doc_ids))
+                doc_ids, scores = doc_ids[accepted], scores[accepted]
+
+        best = np.argsort(-scores, kind="stable")[:k]
+        urls = [tiered_index.urls[doc_id] for doc_id in doc_ids[best].tolist()]
+        return list(zip(urls, scores[best].tolist()))
+
     @staticmethod
     def split_link_weight(number_of_pages, url, links):
         if not links:
@@ -117,66 +647,371 @@ class PageRank:
             for url, content, links in pages
         ]
         transition_matrix = np.matrix(transition_probabilities)
+        # the share of links that lead outside the pages is spread over every page, like a dangling page's
+        transition_matrix += (1 - transition_matrix.sum(axis=1)) / number_of_pages
         markov_transition_matrix = self.teleport(number_of_pages, transition_matrix)
         return markov_transition_matrix
 
     def teleport(self, number_of_pages, transition_matrix):
         return transition_matrix * (1 - self.teleport_rate) + self.teleport_rate / number_of_pages
 
-    def power_method(self, number_of_pages, transition_matrix):
-        # initial ranking score is 1/N for every page
-        ranks = [1 / number_of_pages] * number_of_pages
-        for i in range(self.max_iterations):
-            new_ranks = ranks * transition_matrix
-            logging.debug(f"step {i} {new_ranks}")
-            if np.allclose(ranks, new_ranks):
-                break
-            ranks = new_ranks
+    def power_method(self, number_of_pages, transition_matrix, initial_ranks=None):
+        if initial_ranks is None:
+            # initial ranking score is 1/N for every page
+            initial_ranks = np.full(number_of_pages, 1 / number_of_pages)
+        ranks = self.solver.solve(lambda ranks: np.asarray(ranks @ transition_matrix).ravel(), initial_ranks)
+        return ranks.tolist()
+
+    def create_link_graph(self, pages):
+        number_of_pages = len(pages)
+        doc_id_by_url = {url: doc_id for doc_id, (url, content, links) in enumerate(pages)}
+        out_degrees = np.array([len(links) for url, content, links in pages], dtype=np.int64)
+        sources = np.repeat(np.arange(number_of_pages), out_degrees)
+        # links outside pages keep their share of the weight, it is spread over every page like a dangling page's
+        targets = np.array(
+            [doc_id_by_url.get(link, -1) for url, content, links in pages for link in links], dtype=np.int64
+        )
+        known = targets >= 0
+        # a page linked twice is still one edge
+        edges = np.sort(sources[known] * number_of_pages + targets[known])
+        edges = edges[np.diff(edges, prepend=-1) != 0]
+        sources, indices = np.divmod(edges, number_of_pages)
+        indptr = np.zeros(number_of_pages + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=number_of_pages), out=indptr[1:])
+        data = 1 / out_degrees[sources]
+        return LinkGraph(indptr, indices, data, out_degrees == 0)
+
+    def sparse_power_method(self, number_of_pages, link_graph, initial_ranks=None):
+        indptr, indices, data, _ = link_graph
+        sources = np.repeat(np.arange(number_of_pages), np.diff(indptr))
+        # a dangling page links to every page, and so does the share of links that lead outside the pages
+        spread = 1 - np.bincount(sources, weights=data, minlength=number_of_pages)
+        if initial_ranks is None:
+            # initial ranking score is 1/N for every page
+            initial_ranks = np.full(number_of_pages, 1 / number_of_pages)
+
+        def step(ranks):
+            # not in place, the bincount of a graph without links is integer
+            new_ranks = np.bincount(indices, weights=ranks[sources] * data, minlength=number_of_pages)
+            new_ranks = new_ranks + ranks @ spread / number_of_pages
+            # teleporting is a rank one correction, every page gets the same share of the total rank
+            return new_ranks * (1 - self.teleport_rate) + self.teleport_rate * ranks.sum() / number_of_pages
+
+        return self.solver.solve(step, initial_ranks).tolist()
 
-        return ranks.reshape(-1, ).tolist().pop()
+    def create_page_rank(self, pages, previous_page_rank=None):
+        """previous_page_rank of a similar graph, like before a few pages changed, is a head start"""
+        link_graph = self.create_link_graph(pages)
+        initial_ranks = None
+        if previous_page_rank:
+            # new pages start from the average rank
+            initial_ranks = np.array([previous_page_rank.get(url, 1 / len(pages)) for url, content, links in pages])
+        ranks = self.sparse_power_method(len(pages), link_graph, initial_ranks)
+        return self.get_ranks_by_url(pages, ranks)
 
-    def create_page_rank(self, pages):
+    def create_dense_page_rank(self, pages):
+        """reference implementation, needs N^2 memory"""
         transition_matrix = self.create_transition_matrix(pages)
         logging.debug(f"transition_matrix {transition_matrix}")
         ranks = self.power_method(len(pages), transition_matrix)
-        urls = [page[0] for page in pages]
-        page_rank = {
-            url: round(rank, 3)
-            for url, rank in zip(urls, ranks)
-        }
-        return page_rank
+        return self.get_ranks_by_url(pages, ranks)
+
+    @staticmethod
+    def get_ranks_by_url(pages, ranks):
+        # not rounded, impacts of pages with small ranks would round to 0
+        return {page[0]: rank for page, rank in zip(pages, ranks)}
+
+
+class QueryCache:
+    """LRU cache of search results bounded by their approximate size in bytes, emptied when the index changes"""
+
+    def __init__(self, max_bytes=2 ** 26):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (results, nbytes)
+        self.nbytes = 0
+        self.generation = None
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def get_size(key, results):
+        nbytes = sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key) + sys.getsizeof(results)
+        for result in results:
+            url, score = result
+            nbytes += sys.getsizeof(result) + sys.getsizeof(url) + sys.getsizeof(score)
+        return nbytes
+
+    def check_generation(self, generation):
+        if generation != self.generation:
+            self.entries.clear()
+            self.nbytes = 0
+            self.generation = generation
+
+    def get(self, key, generation):
+        self.check_generation(generation)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, generation, results):
+        self.check_generation(generation)
+        nbytes = self.get_size(key, results)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (results, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class SearchEngine():
-    def __init__(self, indexer, ranker):
+    # "a phrase" or "a proximity query"~3
+    phrase_pattern = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+    def __init__(self, indexer, ranker, cache=None, fuzzy_distance=0, tier_size=0):
         self.indexer = indexer
         self.ranker = ranker
+        self.cache = cache
+        # query terms also match index terms this many edits away
+        self.fuzzy_distance = fuzzy_distance
+        # top k searches try the tier_size highest impacts of every term first, 0 uses the threshold algorithm
+        self.tier_size = tier_size
+        # index terms by their deletes, built on the first fuzzy search and given the new terms of later ones,
+        # see fuzzy.py
+        self.term_expander = None
+        self.term_expander_generation = None
         self.index = self.page_rank = self.number_of_pages = None
+        # only built when the indexer keeps positions
+        self.positional_index = None
+        # bumped on every change of the index, cached results of older generations are stale
+        self.generation = 0
+        # built on the first top k or boolean search
+        self.impact_index = self.doc_id_index = self.tiered_index = None
+        # url -> links, only kept for engines built with add_pages
+        self.links = None
+        # page rank before the last add_pages or remove_pages, a warm start for the next one
+        self.previous_page_rank = None
 
-    def start(self, pages):
-        self.index = self.indexer.get_index(pages)
+    def index_changed(self):
+        self.generation += 1
+        self.impact_index = self.doc_id_index = self.tiered_index = None
+
+    def start(self, pages, workers=1):
+        self.index = self.indexer.build_index(pages, workers)
         self.page_rank = self.ranker.create_page_rank(pages)
         self.number_of_pages = len(pages)
+        if self.indexer.positions:
+            self.positional_index = self.indexer.get_positional_index(pages)
+        # a new index, not a few new terms
+        self.term_expander = None
+        self.index_changed()
+
+    def save(self, path):
+        """write index and page rank to a segment file, see segment.py"""
+        if self.page_rank is None:
+            self.update_page_rank()
+        save_segment(path, self.index, self.page_rank, self.number_of_pages, type(self.indexer.scorer).__name__)
+
+    def open(self, path):
+        """serve a saved segment, memory mapped and read-only"""
+        segment = open_segment(path)
+        if segment.scorer != type(self.indexer.scorer).__name__:
+            raise SegmentError(f"{path} was weighted by {segment.scorer}, not {type(self.indexer.scorer).__name__}")
+        self.index = segment.index
+        self.page_rank = segment.page_rank
+        self.number_of_pages = segment.number_of_pages
+        # segments don't store positions
+        self.links = self.positional_index = self.term_expander = None
+        self.index_changed()
+
+    def add_pages(self, pages):
+        if self.index is None:
+            self.index = IncrementalIndex(self.indexer.scorer)
+            self.links = {}
+            if self.indexer.positions:
+                self.positional_index = PositionalIndex()
+        elif not isinstance(self.index, IncrementalIndex):
+            raise ValueError("can't add pages to an index built by start, build it with add_pages")
+
+        for url, content, links in pages:
+            self.index.add(url, self.indexer.get_counts(content))
+            self.links[url] = links
+            if self.positional_index is not None:
+                self.positional_index.add(url, self.indexer.get_positions(content))
+        self.number_of_pages = self.index.number_of_pages
+        self.page_rank_changed()
+        self.index_changed()
+
+    def update_page(self, page):
+        self.add_pages([page])
+
+    def remove_pages(self, urls):
+        if not isinstance(self.index, IncrementalIndex):
+            raise ValueError("can't remove pages from an index built by start, build it with add_pages")
+        # every url is checked before any is removed, a bad one leaves the engine as it was
+        urls = list(dict.fromkeys(urls))
+        unknown = [url for url in urls if url not in self.links]
+        if unknown:
+            raise KeyError(f"no pages {', '.join(unknown)}")
+
+        for url in urls:
+            self.index.remove(url)
+            del self.links[url]
+            if self.positional_index is not None:
+                self.positional_index.remove(url)
+        self.number_of_pages = self.index.number_of_pages
+        self.page_rank_changed()
+        self.index_changed()
+
+    def add_field(self, name, pages, weight=1.0, b=None):
+        """
+        score pages by another field too, like titles or the anchor text of links to them, pages are (url, text) pairs,
+        needs an engine started with a bm25.BM25 scorer, the fields already there are not tokenized again
+        """
+        if not isinstance(self.index, FieldIndex):
+            raise ValueError("fields need an index built by start with a BM25 scorer")
+        self.index.add_field(name, self.indexer.get_posting_arrays((url, text, []) for url, text in pages), weight, b)
+        self.index_changed()
+
+    def page_rank_changed(self):
+        # page rank is recomputed on the next search, starting from the last one
+        if self.page_rank is not None:
+            self.previous_page_rank = self.page_rank
+        self.page_rank = None
+
+    def update_page_rank(self):
+        pages = [(url, None, links) for url, links in self.links.items()]
+        self.page_rank = self.ranker.create_page_rank(pages, self.previous_page_rank)
+
+    def expand_terms(self, query_terms):
+        """every index term within fuzzy_distance edits of a query term"""
+        if self.term_expander is None or self.term_expander.max_distance != self.fuzzy_distance:
+            self.term_expander = CompactDeleteIndex(self.index, self.fuzzy_distance)
+        elif self.term_expander_generation != self.generation:
+            # terms removed from the index stay in the expander, they are left out below
+            self.term_expander.add(self.index)
+        self.term_expander_generation = self.generation
+        expanded = set(query_terms)
+        for term in query_terms:
+            expanded.update(candidate for candidate in self.term_expander.lookup(term) if candidate in self.index)
+        return frozenset(expanded)
+
+    def get_phrases(self, query):
+        """(phrase, slop) pairs of the quoted parts of a query, a phrase is a tuple of (offset, term)"""
+        tokenizer = self.indexer.tokenizer
+        phrases = (
+            (tuple(tokenizer.position_generator(text, correct=True, vocabulary=self.index)), int(slop or 0))
+            for text, slop in self.phrase_pattern.findall(query)
+        )
+        # a phrase of stop words has no terms, it matches nothing and leaves the query alone, like in QueryParser
+        return frozenset((phrase, slop) for phrase, slop in phrases if phrase)
 
-    def search(self, query):
-        cosine_similarity_scores = self.ranker.get_cosine_similarity_scores(self.index, self.number_of_pages, query)
+    def search(self, query, k=None):
+        """
+        all matching pages, or only the best k of them without scoring every match
+
+        quoted phrases must appear in the page when the engine keeps positions, otherwise they are plain terms,
+        queries with AND, OR, NOT or balanced parentheses are boolean queries, see query.py,
+        the ones that don't parse are searched as plain queries
+        """
+        if is_boolean(query):
+            try:
+                node = QueryParser(self.indexer.tokenizer, self.index).parse(query)
+                return self.cached((node, k), self.get_boolean_results, node, k)
+            except QueryError as e:
+                logging.debug(f"searching {query!r} as a plain query, {e}")
+
+        # the query goes through the same tokenizer as the pages, plus spelling correction of the words it doesn't have,
+        # inside quotes too
+        query_terms = frozenset(self.indexer.tokenizer.token_generator(query, correct=True, vocabulary=self.index))
+        if self.fuzzy_distance:
+            query_terms = self.expand_terms(query_terms)
+        phrases = self.get_phrases(query) if self.positional_index is not None else frozenset()
+        return self.cached((query_terms, phrases, k), self.get_results, query_terms, phrases, k)
+
+    def cached(self, key, get_results, *args):
+        if self.cache is None:
+            return get_results(*args)
+        results = self.cache.get(key, self.generation)
+        if results is None:
+            results = get_results(*args)
+            self.cache.put(key, self.generation, results)
+        return list(results)
+
+    def get_boolean_results(self, node, k):
+        if self.page_rank is None:
+            self.update_page_rank()
+        if node is None:
+            return []
+        if self.doc_id_index is None:
+            self.doc_id_index = DocIdIndex(self.index, self.page_rank)
+        if self.impact_index is None:
+            self.impact_index = ImpactIndex(self.index, self.page_rank)
+
+        matches = QueryEvaluator(self.doc_id_index, self.positional_index).evaluate(node)
+        # dfs come from the index, the impact index would sort every posting list to count it
+        query_weights = self.ranker.get_query_weights(self.index, self.number_of_pages, positive_terms(node))
+        if query_weights:
+            # only the matching pages are scored, by random access to their impacts
+            final_scores = [
+                (url, sum(weight * self.impact_index.get_impact(term, url) for term, weight in query_weights.items()))
+                for url in matches
+            ]
+        else:
+            # nothing to score against, like NOT romeo, page rank alone orders the pages
+            final_scores = [(url, self.page_rank.get(url)) for url in matches]
+
+        if k is None:
+            return sorted(final_scores, key=operator.itemgetter(1), reverse=True)
+        return heapq.nlargest(k, final_scores, key=operator.itemgetter(1))
+
+    def get_results(self, query_terms, phrases, k):
+        if self.page_rank is None:
+            self.update_page_rank()
+        accept = None
+        if phrases:
+            matches = set.intersection(*(self.positional_index.match_phrase(*phrase) for phrase in phrases))
+            accept = matches.__contains__
+
+        if k is not None and self.tier_size:
+            if self.tiered_index is None:
+                self.tiered_index = TieredIndex(self.index, self.page_rank, self.tier_size)
+            return self.ranker.get_tiered_top_k_scores(self.tiered_index, self.number_of_pages, query_terms, k, accept)
+        if k is not None:
+            if self.impact_index is None:
+                self.impact_index = ImpactIndex(self.index, self.page_rank)
+            return self.ranker.get_top_k_scores(self.impact_index, self.number_of_pages, query_terms, k, accept)
+        cosine_similarity_scores = self.ranker.get_cosine_similarity_scores(
+            self.index, self.number_of_pages, query_terms
+        )
+        if accept is not None:
+            cosine_similarity_scores = [(url, score) for url, score in cosine_similarity_scores if accept(url)]
         logging.debug(f"cosine_similarity_scores {cosine_similarity_scores}")
         final_scores = [(url, score * self.page_rank.get(url)) for url, score in cosine_similarity_scores]
         results = sorted(final_scores, key=operator.itemgetter(1), reverse=True)
         return results
 
 
-def test_search_engine(pages):
+def make_search_engine(fuzzy_distance=0):
     stop_words = {"the", "a", "an", "is", "this", "to"}
     tokenizer = Tokenizer(stop_words)
     scorer = Scorer()
     indexer = Indexer(tokenizer, scorer)
     ranker = PageRank(scorer)
-    engine = SearchEngine(indexer, ranker)
-    engine.start(pages)
-    logging.debug(f"page_rank {engine.page_rank}")
-    logging.debug(engine.index)
+    # expanded terms weigh as much as the words typed, so fuzzy search is opt in
+    return SearchEngine(indexer, ranker, fuzzy_distance=fuzzy_distance)
+
 
+def search_forever(engine):
     while True:
         query = input("search > ")
         if query:
@@ -187,10 +1022,16 @@ def test_search_engine(pages):
                 print("no results")
 
 
+def run_search_engine(pages):
+    engine = make_search_engine()
+    engine.start(pages)
+    logging.debug(f"page_rank { {url: round(rank, 3) for url, rank in engine.page_rank.items()} }")
+    logging.debug(engine.index)
+    search_forever(engine)
+
+
 if __name__ == "__main__":
-    # TODO fuzzy search
-    # TODO lexrank summarizer
-    # TODO integrate with the async crawler
+    # python pipeline.py https://example.com searches a crawled site instead
     pages = [
         ("a.com", "oh romeo wherefore art thou?", ["b.com", "d.com", "e.com"]),
         ("b.com", "These Violent Delights Have Violent Ends", ["d.com", "c.com"]),
@@ -199,4 +1040,4 @@ if __name__ == "__main__":
         ("e.com", "Though this be madness, yet there is method in't.", ["c.com", "a.com"]),
     ]
     logging.getLogger().setLevel("DEBUG")
-    test_search_engine(pages)
\ No newline at end of file
+    run_search_engine(pages)
\ No newline at end of file
@@ -10,7 +10,7 @@ import bs4
 class AsyncCrawler:
     """ a concurrent web crawler """
 
-    def __init__(self, max_concurrency=None):
+    def __init__(self, max_concurrency=None, pages=None):
         self.start_url = None
         self.root_netloc = None
         self.session = None
@@ -27,16 +27,26 @@ class AsyncCrawler:
 
         self.sitemap = collections.defaultdict(set)
 
+        # an asyncio.Queue that gets (url, content, links) of every page and a None after the last one,
+        # when it is bounded and full, crawls wait to put their page, which slows fetching down
+        self.pages = pages
+        self.finished = None
+
     async def fetch(self, url):
         async with self.session.get(url) as response:
             if response.status == 200:
                 return await response.content.read()
 
-    async def parse(self, data, url):
+    def parse(self, data, url):
+        """ text and absolute links of a page """
         soup = bs4.BeautifulSoup(data, features="html.parser")
-        links = set(a.get("href") for a in soup.find_all("a", href=True))
+        links = set()
+        for a in soup.find_all("a", href=True):
+            link, frag = urllib.parse.urldefrag(urllib.parse.urljoin(url, a.get("href")))
+            links.add(link)
         for link in links:
-            asyncio.create_task(self.filter_url(link, url))
+            self.filter_url(link)
+        return soup.get_text(" ", strip=True), sorted(links)
 
     async def crawl(self, url):
         self.todo.remove(url)
@@ -44,21 +54,24 @@ class AsyncCrawler:
         try:
             data = await self.fetch(url)
             if data:
-                await self.parse(data, url)
-        except aiohttp.client_exceptions.ClientError as e:
+                content, links = self.parse(data, url)
+                if self.pages is not None:
+                    await self.pages.put((url, content, links))
+        except (aiohttp.client_exceptions.ClientError, asyncio.TimeoutError) as e:
             logging.info(f"{url}, 'has error', {repr(str(e))}")
         finally:
             self.busy.remove(url)
             self.done.add(url)
-            print(
+            logging.debug(
                 f"{len(self.todo)} todo, {len(self.busy)} pending, {len(self.done)} done"
             )
             self.sem.release()
+            # links are added to todo while parsing, nothing left means nothing more to find
+            if not self.todo and not self.busy:
+                self.finished.set()
 
-    async def filter_url(self, url, parent_url):
+    def filter_url(self, url):
         """ Crawl all links to a domain and its sub-domains """
-        url = urllib.parse.urljoin(parent_url, url)
-        url, frag = urllib.parse.urldefrag(url)
         parsed_link = urllib.parse.urlparse(url)
         is_same_domain = self.root_netloc in parsed_link.netloc
         is_relevant_url = (
@@ -69,29 +82,29 @@ class AsyncCrawler:
         )
         if is_relevant_url:
             self.sitemap[parsed_link.netloc].add(parsed_link.path)
-            await self.add_url(url)
+            self.todo.add(url)
+            asyncio.create_task(self.add_url(url))
 
     async def add_url(self, url):
-        self.todo.add(url)
         await self.sem.acquire()
         asyncio.create_task(self.crawl(url))
 
-    async def run(self):
+    async def run(self, start_url):
+        self.start_url = start_url
+        self.root_netloc = urllib.parse.urlparse(start_url).netloc
+        self.finished = asyncio.Event()
         timeout = aiohttp.ClientTimeout(total=self.timeout)
         # ClientSession is for connection pooling and HTTP keep-alives
         self.session = aiohttp.ClientSession(timeout=timeout)
-        crawl = asyncio.create_task(self.add_url(self.start_url))
-        await asyncio.sleep(1)
-        while self.busy:
-            await asyncio.sleep(1)
-        await crawl
+        self.todo.add(start_url)
+        await self.add_url(start_url)
+        await self.finished.wait()
         await self.session.close()
+        if self.pages is not None:
+            await self.pages.put(None)
 
     def start(self, start_url):
-        loop = asyncio.get_event_loop()
-        self.start_url = start_url
-        self.root_netloc = urllib.parse.urlparse(start_url).netloc
-        loop.run_until_complete(asyncio.gather(self.run()))
+        asyncio.run(self.run(start_url))
         return self.sitemap
 
 